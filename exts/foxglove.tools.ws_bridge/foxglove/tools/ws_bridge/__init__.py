@@ -1 +1,12 @@
-from .extension import *
\ No newline at end of file
+# The Kit extension (extension.py, UI modules) is loaded by Kit from the python.module of extension.toml:
+# importing the package only loads the headless API
+
+from .config import BridgeConfig
+
+try:
+    from .bridge import FoxgloveBridge
+except ModuleNotFoundError as e:
+    # Outside of Isaac Sim (e.g. synthetic load tests), only the simulator-independent modules can be used.
+    # A missing submodule of an installed simulator is an actual error
+    if e.name not in ("omni", "pxr", "carb"):
+        raise
@@ -0,0 +1,73 @@
+import omni.physx as physx # type: ignore
+
+from .config import BridgeConfig
+from .data_collection import DataCollector
+
+
+class FoxgloveBridge():
+    """
+    Runs the Foxglove bridge without the extension UI, e.g. from a standalone SimulationApp script:
+
+        bridge = FoxgloveBridge(BridgeConfig.from_file("foxglove_bridge.json"))
+        bridge.start()
+
+        while simulation_app.is_running():
+            world.step(render=True)
+            bridge.step()
+
+    Instead of calling step(), attach_physics() publishes on every physics step like the extension does.
+    Batched IMUs (imu_batch_rate) are sampled on every physics step from start(), so the substeps run by a single
+    world.step() each keep their reading even when step() is called once per frame.
+    The server runs on its own thread, but subscriptions and parameter changes are applied on Kit's event loop,
+    which is updated by world.step() / simulation_app.update().
+    """
+
+    def __init__(self, config : BridgeConfig = None):
+        self.config = config or BridgeConfig()
+        self.data_collect = DataCollector(self.config)
+        self._physx_subscription = None
+        self._imu_subscription = None
+
+
+    def start(self):
+        """Finds the sensors on the current stage and starts the server"""
+        if not self.data_collect.sensors:
+            self.data_collect.init_sensors()
+        else:
+            self.data_collect.update_sensors()
+
+        self.data_collect.fox_wrap.start(self.config.port, self.data_collect.sensors)
+
+        if self.config.imu_batch_rate > 0 and not self._imu_subscription:
+            physx_interface = physx.acquire_physx_interface()
+            self._imu_subscription = physx_interface.subscribe_physics_step_events(self._on_imu_step)
+
+    def stop(self):
+        self.detach_physics()
+        self._imu_subscription = None
+        self.data_collect.cleanup()
+
+
+    def step(self):
+        """Collects and publishes the data of all subscribed sensors"""
+        self.data_collect.collect_data()
+
+    def update_sensors(self):
+        """Picks up sensors added to or removed from the stage since the last call"""
+        return self.data_collect.update_sensors()
+
+
+    def attach_physics(self):
+        """Publishes automatically on every physics step"""
+        if not self._physx_subscription:
+            physx_interface = physx.acquire_physx_interface()
+            self._physx_subscription = physx_interface.subscribe_physics_step_events(self._on_physics_step)
+
+    def detach_physics(self):
+        self._physx_subscription = None
+
+    def _on_physics_step(self, step):
+        self.step()
+
+    def _on_imu_step(self, step):
+        self.data_collect.sample_imus()
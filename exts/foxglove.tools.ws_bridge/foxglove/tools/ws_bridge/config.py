@@ -0,0 +1,126 @@
+import json
+from fnmatch import fnmatchcase
+
+
+# Publishing rate (Hz) per sensor type, 0 = publish on every physics step
+DEFAULT_RATES = {"camera" : 0,
+                 "imu" : 0,
+                 "articulation" : 0,
+                 "tf_tree" : 0,
+                 "segmentation" : 0,
+                 "segmentation_labels" : 0,
+                 "scene" : 1, # Rate at which the stage is checked for geometry changes
+                 "camera_rendition" : 0,
+                 "contact" : 0,
+                 "rigid_body" : 0}
+
+
+class BridgeConfig():
+    """Settings of the Foxglove bridge, shared by the extension UI and headless scripts"""
+
+    def __init__(self,
+                 port : int = 8765,
+                 cam_width : int = 128,
+                 cam_height : int = 128,
+                 tf_root : str = "/",
+                 rates : dict = None,
+                 include : list = None,
+                 exclude : list = None,
+                 history_duration : float = 0.0,
+                 release_delay : float = 5.0,
+                 compression : bool = True,
+                 compression_policies : dict = None,
+                 compression_threshold : int = 1024,
+                 compression_paths : dict = None,
+                 imu_batch_rate : float = 0.0,
+                 segmentation : dict = None,
+                 segmentation_encoding : str = "png",
+                 scene : bool = False,
+                 camera_renditions : dict = None,
+                 jpeg_backend : str = "auto",
+                 jpeg_subsampling : str = "420",
+                 shards : list = None,
+                 priorities : dict = None,
+                 send_budget : int = 262144,
+                 latest_only : list = None,
+                 rigid_bodies : bool = False):
+
+        self.port = port
+        self.cam_width = cam_width
+        self.cam_height = cam_height
+        self.tf_root = tf_root
+        self.rates = dict(DEFAULT_RATES, **(rates or {}))
+        self.include = include or ["*"] # Glob patterns of the prim paths to publish
+        self.exclude = exclude or [] # Glob patterns of the prim paths to ignore
+        self.history_duration = history_duration # Seconds of messages replayed to new subscribers
+        self.release_delay = release_delay # Seconds before an unused camera is released
+
+        # permessage-deflate, per sensor type: "always", "never" or "auto" (payloads above the threshold)
+        self.compression = compression
+        self.compression_policies = compression_policies or dict()
+        self.compression_threshold = compression_threshold
+        # Policies of specific channels, overriding their sensor type: glob pattern of the channel paths -> policy,
+        # e.g. {"/World/Robot/Camera": "auto"} (the first matching pattern wins)
+        self.compression_paths = compression_paths or dict()
+
+        # Rate (Hz) of batched IMU messages, each holding every reading since the previous one (0 = not batched)
+        self.imu_batch_rate = imu_batch_rate
+
+        # Cameras publishing segmentation masks: glob pattern of the camera paths -> "semantic" or "instance"
+        self.segmentation = segmentation or dict()
+        self.segmentation_encoding = segmentation_encoding # "png" (colorized) or "raw" (mono16 IDs)
+
+        # Publishes the geometry under the TF root on /scene, attached to the frames of /tf
+        self.scene = scene
+
+        # Downscaled copies of every camera, published on <camera path>/<name>: name -> scale, e.g. {"thumbnail": 0.25}
+        self.camera_renditions = camera_renditions or dict()
+
+        # JPEG encoder of the camera frames: "auto" (simplejpeg if installed), "simplejpeg" or "pillow",
+        # and chroma subsampling: "444", "422" or "420"
+        self.jpeg_backend = jpeg_backend
+        self.jpeg_subsampling = jpeg_subsampling
+
+        # Extra servers, each with its own thread and port, publishing the channels matching their rule instead of
+        # the main server, e.g. [{"types": ["camera", "camera_rendition"]}]. A rule matches sensor "types" and/or
+        # prim "paths" (glob patterns), and may set its "port" (default: port + index of the shard, from 1)
+        self.shards = shards or []
+
+        # Order of the outgoing messages, per sensor type: "high" (sent first), "normal" or "low" (large payloads,
+        # sent within send_budget bytes per tick so that they never hold back the others for long)
+        self.priorities = priorities or dict()
+        self.send_budget = send_budget
+        # Sensor types whose "low" messages still waiting are replaced by newer ones, dropping the stale frames
+        # of a saturated link (none by default: every message is sent), e.g. ["camera"]
+        self.latest_only = latest_only or []
+
+        # Publishes the world pose and velocities of the rigid bodies outside of articulations on <prim path>/state
+        self.rigid_bodies = rigid_bodies
+
+
+    @classmethod
+    def from_dict(cls, config : dict):
+        return cls(**config)
+
+    @classmethod
+    def from_file(cls, path : str):
+        """Loads the settings from a JSON file, e.g. {"port": 8766, "rates": {"camera": 10}}"""
+        with open(path, 'r') as config_file:
+            return cls.from_dict(json.load(config_file))
+
+
+    def is_included(self, prim_path : str):
+        """Whether the sensor at prim_path passes the include/exclude filters"""
+        return any(fnmatchcase(prim_path, pattern) for pattern in self.include) \
+                and not any(fnmatchcase(prim_path, pattern) for pattern in self.exclude)
+
+    def get_segmentation(self, camera_path : str):
+        """Segmentation type published for a camera, None if disabled"""
+        for pattern, segmentation in self.segmentation.items():
+            if fnmatchcase(camera_path, pattern):
+                return segmentation
+
+    def get_period(self, sensor_type : str):
+        """Minimum time between two messages of a sensor type, in seconds"""
+        rate = self.rates.get(sensor_type, 0)
+        return 1.0 / rate if rate > 0 else 0.0
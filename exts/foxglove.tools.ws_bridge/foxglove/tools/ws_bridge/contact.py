@@ -0,0 +1,96 @@
+# Contact sensors: the net contact forces of the rigid bodies carrying them are read through a single
+# omni.physics.tensors rigid contact view, in one call per step for all the subscribed sensors.
+
+import math
+
+from google.protobuf.descriptor_pb2 import FieldDescriptorProto
+
+from foxglove_schemas_protobuf.Vector3_pb2 import Vector3
+
+from .physics_views import PhysicsViewReader
+from .schemas import build_message_class
+
+
+DEFAULT_STEPS_PER_SECOND = 60 # Physics rate when the physics scene does not set one
+
+ContactForce = build_message_class("foxglove_isaac_sim/ContactForce.proto", "foxglove_isaac_sim.ContactForce",
+    [("frame_id", 1, FieldDescriptorProto.TYPE_STRING, None), # Rigid body of the sensor
+     ("in_contact", 2, FieldDescriptorProto.TYPE_BOOL, None), # Force above the threshold
+     ("magnitude", 3, FieldDescriptorProto.TYPE_DOUBLE, None), # Newtons
+     ("force", 4, FieldDescriptorProto.TYPE_MESSAGE, ".foxglove.Vector3")], # World frame
+    dependencies=[Vector3.DESCRIPTOR.file.name])
+
+
+class ContactReader(PhysicsViewReader):
+    """Net contact forces of the subscribed contact sensors, shared by them and read once per step"""
+
+    def __init__(self):
+        super().__init__()
+        self._thresholds = dict() # Maps sensor paths to their minimum force, in newtons
+        self._physics_dt = 1.0 / DEFAULT_STEPS_PER_SECOND
+
+
+    def add(self, prim):
+        """Adds a contact sensor prim to the batched read (its parent is the rigid body in contact)"""
+        path = str(prim.GetPath())
+        threshold = prim.GetAttribute("threshold").Get() if prim.HasAttribute("threshold") else None
+
+        self._thresholds[path] = float(threshold[0]) if threshold is not None else 0.0
+        self.add_target(path, str(prim.GetParent().GetPath()))
+
+    def remove(self, path : str):
+        self._thresholds.pop(path, None)
+        super().remove(path)
+
+
+    def get_threshold(self, path : str):
+        return self._thresholds.get(path, 0.0)
+
+    def get_body(self, path : str):
+        return self.get_target(path)
+
+    def get_force(self, path : str, now : float = None):
+        """Net force on the body of a sensor, None if it cannot be read. The first call of a step reads all bodies"""
+        row = self.get_row(path, now)
+        if row is None:
+            return
+        return self._values[row]
+
+
+    def create_view(self, simulation_view, prim_paths : list):
+        import omni.usd # type: ignore
+
+        self._physics_dt = 1.0 / get_steps_per_second(omni.usd.get_context().get_stage())
+        return simulation_view.create_rigid_contact_view(prim_paths)
+
+    def read_view(self, view):
+        # Contact impulses of the last physics step, converted to forces
+        return view.get_net_contact_forces(dt=self._physics_dt)
+
+
+def get_steps_per_second(stage):
+    """Physics steps per second of the first physics scene of the stage"""
+    from pxr import PhysxSchema, UsdPhysics # type: ignore
+
+    for prim in stage.Traverse():
+        if prim.IsA(UsdPhysics.Scene) and prim.HasAPI(PhysxSchema.PhysxSceneAPI):
+            steps = PhysxSchema.PhysxSceneAPI(prim).GetTimeStepsPerSecondAttr().Get()
+            if steps:
+                return steps
+
+    return DEFAULT_STEPS_PER_SECOND
+
+
+def fill_contact(message, force, threshold : float, frame_id : str):
+    """Writes a net force into an existing ContactForce, returns whether the body is in contact"""
+    x, y, z = (float(value) for value in force)
+    magnitude = math.sqrt(x * x + y * y + z * z)
+
+    message.frame_id = frame_id
+    message.in_contact = magnitude > threshold
+    message.magnitude = magnitude
+    message.force.x = x
+    message.force.y = y
+    message.force.z = z
+
+    return message.in_contact
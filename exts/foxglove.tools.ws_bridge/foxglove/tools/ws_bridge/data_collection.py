@@ -1,77 +1,300 @@
-import io
 import base64
 import os
 import json
-
-from PIL import Image
-import numpy as np
+import time
+import asyncio
+import importlib
 
 import omni # type: ignore
-import omni.isaac.sensor as sensor # type: ignore
-from omni.isaac.core.articulations import Articulation # type: ignore
 from pxr import Gf, UsdGeom # type: ignore
 from pxr.Usd import Prim as Prim # type: ignore
 
-from foxglove_schemas_protobuf.CompressedImage_pb2 import CompressedImage
-from foxglove_schemas_protobuf.FrameTransform_pb2 import FrameTransform
-from foxglove_schemas_protobuf.FrameTransforms_pb2 import FrameTransforms
-from foxglove_schemas_protobuf.Vector3_pb2 import Vector3
-from foxglove_schemas_protobuf.Quaternion_pb2 import Quaternion
+# PIL, numpy, omni.isaac.sensor and the protobuf schemas are imported where they are first used,
+# so that loading the extension stays fast when some sensor types are absent from the stage
 
+from .config import BridgeConfig
 from .foxglove_wrapper import FoxgloveWrapper
+from .server import CompressionPolicy, SendPriorities
+
+
+RELEASE_GRACE_PERIOD = 5.0 # Seconds a camera is kept alive after its last client unsubscribed
+
+SENSOR_TYPES = ["camera", "imu", "articulation", "tf_tree", "segmentation", "segmentation_labels", "scene",
+                "camera_rendition", "contact", "rigid_body"]
+
+# Camera annotators providing the segmentation masks, and the method attaching them
+SEGMENTATION_ANNOTATORS = {"semantic" : ("semantic_segmentation", "add_semantic_segmentation_to_frame"),
+                           "instance" : ("instance_segmentation", "add_instance_segmentation_to_frame")}
+
+# Sensor types read in batches through a physics view, and the class of their shared reader
+PHYSICS_READERS = {"contact" : "foxglove.tools.ws_bridge.contact.ContactReader",
+                   "rigid_body" : "foxglove.tools.ws_bridge.rigid_bodies.RigidBodyReader"}
 
 
 class IsaacSensor():
 
     def __init__(self, sensor_type : str, sensor_path : str, cam_width : int = 128, cam_height : int = 128):
-        self.type = sensor_type # ["camera", "imu", "articulation", "tf_tree"]
+        self.type = sensor_type # One of SENSOR_TYPES
         self.path = sensor_path
 
         self.enabled = False
+        self.cam_width = cam_width
+        self.cam_height = cam_height
+        self.release_delay = RELEASE_GRACE_PERIOD
+
+        self.period = 0.0 # Minimum time between two messages, in seconds (0 = every physics step)
+        self._next_publish = 0.0
+
+        # Batched IMUs sample every physics step and publish all the readings since the last message at once
+        self.batched = False
+        self._imu_batch = []
+        self._last_reading_time = None
+
+        # Tunable from the Foxglove app through parameters (see get_parameters())
+        self.publish = True # Whether subscribed clients receive data at all
+        self.published = 0 # Number of messages collected, shown in the extension UI
+        self.jpeg_quality = 75
+        self.jpeg_subsampling = "420" # Chroma subsampling: "444", "422" or "420"
+        self.jpeg_backend = "auto" # See jpeg.JPEG_BACKENDS
+        self.tf_depth = 0 # Maximum depth of the transform tree (0 = unlimited)
+
+        # The Isaac sensor is only created once a client subscribes (see acquire())
+        self._sensor = None
+        self._release_handle = None
+
+        # Channels derived from a camera (e.g. segmentation) read their data from the source camera,
+        # which is kept alive as long as one of them is subscribed
+        self.source = None
+        self.derived = [] # Paths of the channels derived from this camera
+        self.annotators = set() # Names of the camera annotators used by the derived channels
+        self._users = set() # Paths of the subscribed derived channels
+
+        # Segmentation channels
+        self.segmentation = "semantic" # Key of SEGMENTATION_ANNOTATORS
+        self.segmentation_encoding = "png" # "png" (colorized CompressedImage) or "raw" (mono16 RawImage of the IDs)
+        self._last_labels = None
+
+        # Scene channel, derived from the transform tree
+        self._scene = None
+        self.snapshot = None # Full state sent to new subscribers instead of the cached messages, which are changes only
+
+        # Camera renditions: the frame of the source camera, downscaled
+        self.scale = 1.0
+        self._rgba = None # Frame read during the current step, shared by the camera and its renditions
+        self._rgba_time = None
+
+        # Contact sensors and rigid bodies share the reader batching their reads (see DataCollector.get_reader())
+        self.reader = None
+        self._in_contact = False
+        self._contact_message = None
+        self._rigid_body_message = None
+
+        # Messages and buffers reused between steps, so that collecting does not allocate new ones
+        self._image_message = None
+        self._jpeg_encoder = None
+        self._tf_message = None
+        self._imu_reading = None # Dict of the last IMU reading, when not batched
+        self._joint_states = None
+        self._transform_count = 0
 
         if self.type == "camera":
             self.compressed = True
-            self._sensor = sensor.Camera(self.path, resolution=(cam_width, cam_height))
+
+        elif self.type not in SENSOR_TYPES:
+            print("[Error] Invalid sensor type")
+
+
+    def acquire(self):
+        """Creates the underlying Isaac sensor, if it does not exist yet"""
+        if self._sensor is not None:
+            return
+
+        if self.type == "camera":
+            import omni.isaac.sensor as sensor # type: ignore
+            self._sensor = sensor.Camera(self.path, resolution=(self.cam_width, self.cam_height))
             self._sensor.initialize()
+            for annotator in self.annotators:
+                self._attach_annotator(annotator)
 
         elif self.type == "imu":
+            import omni.isaac.sensor as sensor # type: ignore
             self._sensor = sensor._sensor.acquire_imu_sensor_interface()
-        
+
         elif self.type == "articulation":
+            from omni.isaac.core.articulations import Articulation # type: ignore
             self._sensor = Articulation(self.path)
             self._sensor.initialize()
-        
+
         elif self.type == "tf_tree":
             self._sensor = omni.usd.get_context().get_stage()
-        
-        else:
-            print("[Error] Invalid sensor type")
-    
+
+        elif self.type in PHYSICS_READERS:
+            self.reader.add(omni.usd.get_context().get_stage().GetPrimAtPath(self.path))
+            self._sensor = self.reader
+
+
+    def release(self):
+        """Destroys the underlying Isaac sensor (and the render product of cameras)"""
+        self._cancel_release()
+
+        if self.type == "camera" and self._sensor is not None:
+            try:
+                self._sensor.destroy()
+            except Exception as e:
+                print(e)
+
+        if self.type in PHYSICS_READERS and self._sensor is not None:
+            self._sensor.remove(self.path)
+
+        self._sensor = None
+        self._rgba = None
+
 
     def enable(self):
+        self._cancel_release()
+        if self.source:
+            self.source.add_user(self)
+        else:
+            self.acquire()
+        self._last_labels = None
+        self._in_contact = True # The first reading is published even without contact
         self.enabled = True
-    
+
     def disable(self):
         self.enabled = False
+        self._imu_batch = []
+
+        if self.source:
+            self.source.remove_user(self)
+        elif self.type in PHYSICS_READERS:
+            self.release() # Only the subscribed sensors are part of the batched read
+        else:
+            self._schedule_release()
+
+    def add_user(self, derived):
+        """Keeps the camera alive while a channel derived from it is subscribed"""
+        self._cancel_release()
+        self._users.add(derived.path)
+        self.acquire()
+
+    def remove_user(self, derived):
+        self._users.discard(derived.path)
+        self._schedule_release()
+
+    def _schedule_release(self):
+        # Cameras cost GPU time on every frame: free them if nobody subscribes again soon
+        if self.type == "camera" and self._sensor is not None and not self.enabled and not self._users:
+            self._cancel_release()
+            loop = asyncio.get_event_loop()
+            self._release_handle = loop.call_later(self.release_delay, self._release_if_disabled)
+
+    def _release_if_disabled(self):
+        self._release_handle = None
+        if not self.enabled and not self._users:
+            self.release()
+
+    def _cancel_release(self):
+        if self._release_handle:
+            self._release_handle.cancel()
+            self._release_handle = None
+
+
+    def add_annotator(self, annotator : str):
+        """Adds a camera annotator (e.g. "semantic_segmentation") to the frames of the camera"""
+        if annotator not in self.annotators:
+            self.annotators.add(annotator)
+            if self._sensor is not None:
+                self._attach_annotator(annotator)
+
+    def _attach_annotator(self, annotator : str):
+        for name, add_method in SEGMENTATION_ANNOTATORS.values():
+            if name == annotator:
+                getattr(self._sensor, add_method)()
+
+    def get_annotator_data(self, annotator : str):
+        """Latest output of a camera annotator, None if the camera is not running"""
+        if self._sensor is None:
+            return
+        return self._sensor.get_current_frame().get(annotator)
+
+
+    def is_due(self, now : float):
+        """Whether the sensor should publish at time now, according to its rate"""
+        if now < self._next_publish:
+            return False
+
+        self._next_publish = max(self._next_publish + self.period, now)
+        return True
+
+
+    def get_parameters(self):
+        """Returns the tunable settings of the sensor, exposed as Foxglove parameters"""
+        parameters = {"rate": 1.0 / self.period if self.period > 0 else 0.0,
+                      "publish": self.publish}
+
+        if self.type == "camera":
+            parameters["resolution"] = [self.cam_width, self.cam_height]
+            parameters["jpeg_quality"] = self.jpeg_quality
+            parameters["jpeg_subsampling"] = self.jpeg_subsampling
+
+        elif self.type == "camera_rendition":
+            parameters["jpeg_quality"] = self.jpeg_quality
+            parameters["jpeg_subsampling"] = self.jpeg_subsampling
+
+        elif self.type == "tf_tree":
+            parameters["tf_depth"] = self.tf_depth
+
+        return parameters
+
+    def set_parameter(self, name : str, value):
+        """Updates one of the settings returned by get_parameters()"""
+        if name == "rate":
+            self.period = 1.0 / value if value > 0 else 0.0
+            self._next_publish = 0.0
+
+        elif name == "publish":
+            self.publish = bool(value)
+
+        elif name == "resolution" and self.type == "camera":
+            self.update_cam_resolution(int(value[0]), int(value[1]))
+
+        elif name == "jpeg_quality" and self.type in ["camera", "camera_rendition"]:
+            self.jpeg_quality = min(max(int(value), 1), 95)
+
+        elif name == "jpeg_subsampling" and self.type in ["camera", "camera_rendition"] \
+                and str(value) in ["444", "422", "420"]:
+            self.jpeg_subsampling = str(value)
+
+        elif name == "tf_depth" and self.type == "tf_tree":
+            self.tf_depth = max(int(value), 0)
+
+        else:
+            print(f"[Error] Invalid parameter \"{name}\" for {self.path}")
 
 
     def update_cam_resolution(self, width : int, height : int):
         """Changes the camera's resolution"""
         if self.type == "camera":
+            self.cam_width = width
+            self.cam_height = height
 
-            self._sensor = sensor.Camera(self.path, resolution=(width, height))
+            # Only rebuild cameras that are currently in use, others pick up the resolution when acquired
+            if self._sensor is not None:
+                self.release()
+                self.acquire()
 
-            self._sensor.initialize()
-        
         else:
             print("[Error] Not a camera")
     
 
-    def collect(self):
-        """Collect the current data from the sensor"""
+    def collect(self, now : float = None):
+        """Collect the current data from the sensor (now identifies the step, so that cameras are read once per step)"""
 
         if self.type == "camera":
-            return self.cam_collect()
+            return self.cam_collect(now)
+
+        if self.type == "camera_rendition":
+            return self.rendition_collect(now)
 
         if self.type == "imu":
             return self.imu_collect()
@@ -81,24 +304,54 @@ class IsaacSensor():
         
         if self.type == "tf_tree":
             return self.tf_tree_collect()
+
+        if self.type == "segmentation":
+            return self.segmentation_collect()
+
+        if self.type == "segmentation_labels":
+            return self.segmentation_labels_collect()
+
+        if self.type == "scene":
+            return self.scene_collect()
+
+        if self.type == "contact":
+            return self.contact_collect(now)
+
+        if self.type == "rigid_body":
+            return self.rigid_body_collect(now)
     
 
-    def cam_collect(self):
+    def read_rgba(self, now : float = None):
+        """Current RGBA frame of the camera, read once per step however many renditions use it"""
+        if now is None or now != self._rgba_time:
+            self._rgba = self._sensor.get_rgba() if self._sensor is not None else None
+            self._rgba_time = now
+        return self._rgba
+
+    def encode_jpeg(self, frame, frame_id : str):
+        """Serialized CompressedImage of an RGB(A) numpy frame, reusing the message and encoder of the sensor"""
+        from foxglove_schemas_protobuf.CompressedImage_pb2 import CompressedImage
+        from .jpeg import create_encoder
+
+        if self._image_message is None:
+            self._image_message = CompressedImage(format="jpeg", frame_id=frame_id)
+            self._jpeg_encoder = create_encoder(self.jpeg_backend)
+
+        self._image_message.data = self._jpeg_encoder.encode(frame, self.jpeg_quality, self.jpeg_subsampling)
+        return self._image_message.SerializeToString()
+
+
+    def cam_collect(self, now : float = None):
         """Get the current camera frame"""
+        from PIL import Image
+
         try:
             # Compressed Image (Protobuf)
             if self.compressed:
-                image = self._sensor.get_rgb()
-                frame = Image.fromarray(image)
-                buffered = io.BytesIO()
-                frame.save(buffered, format="jpeg")
-
-                compressed_image = CompressedImage()
-                compressed_image.format = "jpeg"
-                compressed_image.data = buffered.getvalue()
-                compressed_image.frame_id = self.path
-
-                payload = compressed_image.SerializeToString()
+                image = self.read_rgba(now)
+                if image is None or image.size == 0: # Not rendered yet
+                    return
+                payload = self.encode_jpeg(image, self.path)
 
             # Raw Image (Not used at the moment)
             else:
@@ -112,7 +365,7 @@ class IsaacSensor():
                 encoding = "rgb8"
                 step = width * 3
 
-                raw_image_data = np.array(image).tobytes()
+                raw_image_data = image.tobytes()
                 frame_base64 = base64.b64encode(raw_image_data).decode('utf-8')
                 data_frame = {"frame_id": self.path,
                               "width": width,
@@ -130,77 +383,217 @@ class IsaacSensor():
         return payload
     
 
+    def rendition_collect(self, now : float = None):
+        """Get the current frame of the source camera, downscaled"""
+        import numpy as np
+        from PIL import Image
+
+        try:
+            image = self.source.read_rgba(now)
+            if image is None or image.size == 0:
+                return
+
+            frame = Image.fromarray(image)
+            factor = round(1 / self.scale)
+            if abs(factor * self.scale - 1) < 1e-6:
+                frame = frame.reduce(factor) # Box filter over factor x factor blocks, the fastest path
+            else:
+                size = (max(round(frame.width * self.scale), 1), max(round(frame.height * self.scale), 1))
+                frame = frame.resize(size, Image.BILINEAR)
+
+            return self.encode_jpeg(np.asarray(frame), self.source.path)
+
+        except Exception as e:
+            print(e)
+            return
+
+
+    def segmentation_collect(self):
+        """Get the current segmentation mask of the source camera"""
+        from .segmentation import encode_png, encode_raw
+
+        annotator, _ = SEGMENTATION_ANNOTATORS[self.segmentation]
+        output = self.source.get_annotator_data(annotator)
+        if output is None:
+            return
+
+        if self.segmentation_encoding == "raw":
+            return encode_raw(output["data"], self.source.path)
+        return encode_png(output["data"], self.source.path)
+
+    def segmentation_labels_collect(self):
+        """Get the ID to label mapping of the source camera, only when it changed"""
+        from .segmentation import encode_labels
+
+        annotator, _ = SEGMENTATION_ANNOTATORS[self.segmentation]
+        output = self.source.get_annotator_data(annotator)
+        if output is None:
+            return
+
+        labels = output["info"]["idToLabels"]
+        if labels == self._last_labels:
+            return
+
+        self._last_labels = dict(labels)
+        return encode_labels(labels, self.source.path)
+
+
+    def scene_collect(self):
+        """Get the entities changed under the TF root, only when there are some (new subscribers receive the
+        whole scene, see self.snapshot)"""
+        from .scene import SceneCache
+
+        if self._scene is None:
+            self._scene = SceneCache()
+
+        # Entities are attached to the frames published by the transform tree
+        if self._scene.update(self.source._sensor, self.source.path, self.source.is_tf_frame):
+            self.snapshot = self._scene.serialize()
+            return self._scene.serialize_changes()
+
+
+    def contact_collect(self, now : float = None):
+        """Get the net contact force on the body of the sensor, suppressed while it stays out of contact"""
+        from .contact import ContactForce, fill_contact
+
+        force = self._sensor.get_force(self.path, now) if self._sensor is not None else None
+        if force is None:
+            return
+
+        if self._contact_message is None:
+            self._contact_message = ContactForce()
+
+        frame_id = self._sensor.get_body(self.path).rsplit("/", 1)[-1] # TF frames are named after their prims
+        in_contact = fill_contact(self._contact_message, force, self._sensor.get_threshold(self.path), frame_id)
+
+        # Only the first reading without contact is sent, so that the last force shown drops to zero
+        if not in_contact and not self._in_contact:
+            return
+
+        self._in_contact = in_contact
+        return self._contact_message.SerializeToString()
+
+
+    def rigid_body_collect(self, now : float = None):
+        """Get the pose and velocities of the rigid body in the TF root frame"""
+        from .rigid_bodies import RigidBodyState, fill_rigid_body
+
+        state = self._sensor.get_state(self.path, now) if self._sensor is not None else None
+        if state is None:
+            return
+
+        if self._rigid_body_message is None:
+            self._rigid_body_message = RigidBodyState()
+
+        fill_rigid_body(self._rigid_body_message, *state, self._sensor.frame_id)
+        return self._rigid_body_message.SerializeToString()
+
+
     def imu_collect(self):
-        """Get the current IMU reading"""
+        """Get the current IMU reading, or all the readings since the last message when batched"""
+        if self.batched:
+            if not self._imu_batch:
+                return
+
+            payload = json.dumps({"readings": self._imu_batch}).encode("utf8")
+            self._imu_batch = []
+            return payload
+
         imu_out = None
 
         try:
             reading = self._sensor.get_sensor_reading(self.path)
 
             if reading.is_valid:
-                imu_out = {"ang_vel_x": reading.ang_vel_x,
-                           "ang_vel_y": reading.ang_vel_y,
-                           "ang_vel_z": reading.ang_vel_z,
-                           "lin_acc_x": reading.lin_acc_x,
-                           "lin_acc_y": reading.lin_acc_y,
-                           "lin_acc_z": reading.lin_acc_z,
-                           "orientation": [reading.orientation.x,
-                                           reading.orientation.y,
-                                           reading.orientation.z,
-                                           reading.orientation.w],
-                           "time": reading.time}
+                imu_out = self._imu_reading = self.imu_reading_to_dict(reading, self._imu_reading)
         except:
             pass
 
         return json.dumps(imu_out).encode("utf8")
+
+    def imu_sample(self):
+        """Add the current IMU reading to the batch, skipping readings already sampled"""
+        try:
+            reading = self._sensor.get_sensor_reading(self.path)
+
+            if reading.is_valid and reading.time != self._last_reading_time:
+                self._last_reading_time = reading.time
+                self._imu_batch.append(self.imu_reading_to_dict(reading))
+        except:
+            pass
+
+    def imu_reading_to_dict(self, reading, imu_out : dict = None):
+        """Writes an IMU reading into imu_out, reused between steps, or into a new dict (batched readings)"""
+        if imu_out is None:
+            imu_out = {"orientation": [0.0] * 4}
+
+        imu_out["ang_vel_x"] = reading.ang_vel_x
+        imu_out["ang_vel_y"] = reading.ang_vel_y
+        imu_out["ang_vel_z"] = reading.ang_vel_z
+        imu_out["lin_acc_x"] = reading.lin_acc_x
+        imu_out["lin_acc_y"] = reading.lin_acc_y
+        imu_out["lin_acc_z"] = reading.lin_acc_z
+        orientation = imu_out["orientation"]
+        orientation[0] = reading.orientation.x
+        orientation[1] = reading.orientation.y
+        orientation[2] = reading.orientation.z
+        orientation[3] = reading.orientation.w
+        imu_out["time"] = reading.time
+        return imu_out
     
 
     def articulation_collect(self):
         """Get the current joint states (names, positions, velocities, efforts)"""
-        joint_names = self._sensor.dof_names
+        # The dict and its lists are kept between steps, only their values are replaced
+        if self._joint_states is None:
+            self._joint_states = {"joint_positions": [], "joint_velocities": [], "joint_efforts": []}
+        joint_states = self._joint_states
+
+        joint_states["joint_names"] = self._sensor.dof_names
+        joint_states["joint_positions"][:] = self._sensor.get_joint_positions().tolist()
+        joint_states["joint_velocities"][:] = self._sensor.get_joint_velocities().tolist()
+        joint_states["joint_efforts"][:] = self._sensor.get_measured_joint_efforts().tolist()
 
-        joint_states = {"joint_names": joint_names,
-                        "joint_positions": self._sensor.get_joint_positions().tolist(),
-                        "joint_velocities": self._sensor.get_joint_velocities().tolist(),
-                        "joint_efforts": self._sensor.get_measured_joint_efforts().tolist()}
-        
         return json.dumps(joint_states).encode("utf8")
     
     
     def tf_tree_collect(self):
         """Get the current transform tree"""
-        self.transform_list = []
-
-        root = self._sensor.GetPrimAtPath(self.path)
-        self.fetch_transforms(root) # Populate self.transform_list
+        from foxglove_schemas_protobuf.FrameTransforms_pb2 import FrameTransforms
 
-        transform_entries = []
+        # The message and its entries are kept between steps, only their values are updated
+        if self._tf_message is None:
+            self._tf_message = FrameTransforms()
+        self._transform_count = 0
 
-        for matrix, parent_frame_id, child_frame_id in self.transform_list:
-            transform_entries.append(
-                self.create_transform_entry(matrix, parent_frame_id, child_frame_id)
-            )
+        root = self._sensor.GetPrimAtPath(self.path)
+        self.fetch_transforms(root) # Populate self._tf_message
 
-        tf = FrameTransforms()
-        for transform_entry in transform_entries:
-            tf.transforms.add().CopyFrom(transform_entry)
-        payload = tf.SerializeToString()
+        # Frames removed from the tree since the previous step
+        del self._tf_message.transforms[self._transform_count:]
 
-        return payload
+        return self._tf_message.SerializeToString()
     
-    def fetch_transforms(self, prim, parent_prim = None):
+    def fetch_transforms(self, prim, parent_prim = None, depth = 0):
         prim_id = prim.GetName() # str(prim.GetPath())
 
         transform = UsdGeom.Xformable(prim)
         local_transform = transform.GetLocalTransformation()
 
         if parent_prim:
-            self.transform_list.append((local_transform, parent_prim, prim_id))
-        
+            self.fill_transform_entry(self._next_transform_entry(), local_transform, parent_prim, prim_id)
+
+        if self.tf_depth and depth >= self.tf_depth:
+            return
+
         for child in prim.GetChildren():
-            child_type = child.GetTypeName()
-            if self.typeIsValid(child_type) and child.GetName() != "Render":
-                self.fetch_transforms(child, prim_id)
+            if self.is_tf_frame(child, depth + 1):
+                self.fetch_transforms(child, prim_id, depth + 1)
+
+    def is_tf_frame(self, prim, depth : int):
+        """Whether the tree publishes a frame for a prim at depth (the root is at 0) whose parent has one"""
+        return (not self.tf_depth or depth <= self.tf_depth) \
+                and self.typeIsValid(prim.GetTypeName()) and prim.GetName() != "Render"
     
     def typeIsValid(self, prim_type: str):
         return prim_type not in ["OmniGraph", "Scope", "Material"] \
@@ -210,52 +603,64 @@ class IsaacSensor():
 
     def matrix_to_translation_rotation(self, matrix):
         translation = matrix.ExtractTranslation() # Extract translation
-        rotation = Gf.Quatf(matrix.ExtractRotationQuat()) # Extract rotation as quaternion
+        rotation = Gf.Quatf(matrix.RemoveScaleShear().ExtractRotationQuat()) # Extract rotation, without the scale
         return translation, rotation
     
-    def create_transform_entry(self, matrix, parent_frame_id, child_frame_id):
-        translation, rotation = self.matrix_to_translation_rotation(matrix)
+    def _next_transform_entry(self):
+        """Next entry of the reused FrameTransforms message, added only when the tree grew"""
+        transforms = self._tf_message.transforms
+        if self._transform_count < len(transforms):
+            transform_entry = transforms[self._transform_count]
+        else:
+            transform_entry = transforms.add()
 
-        translation_vect = Vector3()
-        translation_vect.x = translation[0]
-        translation_vect.y = translation[1]
-        translation_vect.z = translation[2]
+        self._transform_count += 1
+        return transform_entry
 
-        rotation_quat = Quaternion()
-        rotation_quat.x = rotation.GetImaginary()[0]
-        rotation_quat.y = rotation.GetImaginary()[1]
-        rotation_quat.z = rotation.GetImaginary()[2]
-        rotation_quat.w = rotation.GetReal()
+    def fill_transform_entry(self, transform_entry, matrix, parent_frame_id, child_frame_id):
+        """Writes a transform into an existing FrameTransform, in place"""
+        translation, rotation = self.matrix_to_translation_rotation(matrix)
+        imaginary = rotation.GetImaginary()
 
-        transform_entry = FrameTransform()
         transform_entry.parent_frame_id = parent_frame_id
         transform_entry.child_frame_id = child_frame_id
-        transform_entry.translation.CopyFrom(translation_vect)
-        transform_entry.rotation.CopyFrom(rotation_quat)
-        
-        return transform_entry
+
+        transform_entry.translation.x = translation[0]
+        transform_entry.translation.y = translation[1]
+        transform_entry.translation.z = translation[2]
+
+        transform_entry.rotation.x = imaginary[0]
+        transform_entry.rotation.y = imaginary[1]
+        transform_entry.rotation.z = imaginary[2]
+        transform_entry.rotation.w = rotation.GetReal()
 
 
 
 class DataCollector():
 
-    def __init__(self):
+    def __init__(self, config : BridgeConfig = None):
         """
         self.sensors = {"path1" : IsaacSensor(type1, path1),
                         "path2" : IsaacSensor(type2, path2),
                         "path3" : IsaacSensor(type3, path3)}
         """
-        self.tf_root = "/"
-        self.cam_width = 128
-        self.cam_height = 128
+        self.config = config or BridgeConfig()
+        self.tf_root = self.config.tf_root
+        self.cam_width = self.config.cam_width
+        self.cam_height = self.config.cam_height
 
         self.sensors = dict()
-        self.sensors_sorted = {"camera" : set(),
-                            "imu" : set(),
-                            "articulation" : set(),
-                            "tf_tree" : set()}
-        
-        self.fox_wrap = FoxgloveWrapper(self)
+        self.sensors_sorted = {sensor_type : set() for sensor_type in SENSOR_TYPES}
+        self.readers = dict() # Maps sensor types to the reader batching their physics reads, created with the first one
+        self._articulation_links = None # Paths of the rigid bodies of articulations, found again on each update
+
+        compression = CompressionPolicy(self.config.compression,
+                                        self.config.compression_policies,
+                                        self.config.compression_threshold,
+                                        self.config.compression_paths)
+        priorities = SendPriorities(self.config.priorities, self.config.send_budget, self.config.latest_only)
+        self.fox_wrap = FoxgloveWrapper(self, history_duration=self.config.history_duration, compression=compression,
+                                        shards=self.config.shards, priorities=priorities)
         
 
     def init_sensors(self):
@@ -263,9 +668,7 @@ class DataCollector():
         stage = omni.usd.get_context().get_stage()
 
         # Transform Tree
-        root_path = str(stage.GetPseudoRoot().GetPath())
-        self.sensors[root_path] = IsaacSensor("tf_tree", root_path)
-        self.sensors_sorted["tf_tree"] = {root_path}
+        self.add_sensor(stage.GetPrimAtPath(self.tf_root), tf=True)
 
         self.update_sensors()
 
@@ -274,9 +677,10 @@ class DataCollector():
 
         status = None
         stage = omni.usd.get_context().get_stage()
+        self._articulation_links = None
 
-        stored_stage_objects = set(self.sensors.keys())
-        actual_stage_objects = set(self.tf_root)
+        stored_stage_objects = {path for path, sensor in self.sensors.items() if sensor.source is None}
+        actual_stage_objects = {self.tf_root}
 
         # Add new prims
         for prim in stage.Traverse():
@@ -303,6 +707,10 @@ class DataCollector():
         if tf:
             prim_type = "tf_tree"
 
+        # Filtered out by the settings
+        elif not self.config.is_included(prim_path):
+            prim_type = "invalid"
+
         # Camera
         elif prim.IsA(UsdGeom.Camera):
             prim_type = "camera"
@@ -314,6 +722,17 @@ class DataCollector():
         # Articulation
         elif "PhysicsArticulationRootAPI" in prim.GetAppliedSchemas():
             prim_type = "articulation"
+
+        # Contact sensor
+        elif prim.GetTypeName() == "IsaacContactSensor":
+            prim_type = "contact"
+
+        # Rigid body outside of an articulation
+        elif self.config.rigid_bodies and "PhysicsRigidBodyAPI" in prim.GetAppliedSchemas():
+            from .rigid_bodies import find_articulation_links
+            if self._articulation_links is None:
+                self._articulation_links = find_articulation_links(prim.GetStage())
+            prim_type = "invalid" if prim_path in self._articulation_links else "rigid_body"
         
         # Invalid
         else:
@@ -322,24 +741,112 @@ class DataCollector():
         if prim_type != "invalid":
 
             self.sensors[prim_path] = IsaacSensor(prim_type, prim_path, cam_width=cam_width, cam_height=cam_height)
+            self.sensors[prim_path].period = self.config.get_period(prim_type)
+            self.sensors[prim_path].release_delay = self.config.release_delay
+
+            if prim_type == "imu" and self.config.imu_batch_rate > 0:
+                self.sensors[prim_path].batched = True
+                self.sensors[prim_path].period = 1.0 / self.config.imu_batch_rate
+
+            if prim_type in PHYSICS_READERS:
+                self.sensors[prim_path].reader = self.get_reader(prim_type)
             self.sensors_sorted[prim_type].add(prim_path)
 
             self.fox_wrap.add_channel(self.sensors[prim_path])
 
+            if prim_type == "camera":
+                self.sensors[prim_path].jpeg_backend = self.config.jpeg_backend
+                self.sensors[prim_path].jpeg_subsampling = self.config.jpeg_subsampling
+                self.add_segmentation(self.sensors[prim_path])
+                self.add_renditions(self.sensors[prim_path])
+
+            if prim_type == "tf_tree" and self.config.scene:
+                self.add_scene(self.sensors[prim_path])
+
             return prim_type
         
     
+    def get_reader(self, sensor_type : str):
+        """Reader batching the physics reads of the sensors of a type, shared by all of them"""
+        if sensor_type not in self.readers:
+            module_name, class_name = PHYSICS_READERS[sensor_type].rsplit(".", 1)
+            self.readers[sensor_type] = getattr(importlib.import_module(module_name), class_name)()
+            if sensor_type == "rigid_body":
+                self.readers[sensor_type].set_root(omni.usd.get_context().get_stage().GetPrimAtPath(self.tf_root))
+        return self.readers[sensor_type]
+
     def remove_sensor(self, sensor_path : str):
         if sensor_path in self.sensors:
 
             sensor = self.sensors.pop(sensor_path)
             self.sensors_sorted[sensor.type].remove(sensor_path)
+            sensor.release()
+
+            for derived_path in sensor.derived:
+                self.remove_sensor(derived_path)
 
             self.fox_wrap.remove_channel(sensor_path)
 
             return sensor.type
     
 
+    def add_segmentation(self, camera : IsaacSensor):
+        """Adds the segmentation mask and labels channels of a camera, if enabled for it in the settings"""
+        segmentation = self.config.get_segmentation(camera.path)
+        if segmentation not in SEGMENTATION_ANNOTATORS:
+            return
+
+        camera.add_annotator(SEGMENTATION_ANNOTATORS[segmentation][0])
+
+        mask_path = f"{camera.path}/{segmentation}_segmentation"
+        for sensor_type, path in [("segmentation", mask_path), ("segmentation_labels", mask_path + "/labels")]:
+            derived = IsaacSensor(sensor_type, path)
+            derived.source = camera
+            derived.segmentation = segmentation
+            derived.segmentation_encoding = self.config.segmentation_encoding
+            derived.period = self.config.get_period(sensor_type)
+
+            self.sensors[path] = derived
+            self.sensors_sorted[sensor_type].add(path)
+            camera.derived.append(path)
+
+            self.fox_wrap.add_channel(derived)
+
+
+    def add_renditions(self, camera : IsaacSensor):
+        """Adds a channel per downscaled rendition of a camera, e.g. <camera path>/thumbnail"""
+        for name, scale in self.config.camera_renditions.items():
+            path = f"{camera.path}/{name}"
+
+            rendition = IsaacSensor("camera_rendition", path)
+            rendition.source = camera
+            rendition.scale = min(max(float(scale), 0.01), 1.0)
+            rendition.period = self.config.get_period("camera_rendition")
+            rendition.jpeg_backend = self.config.jpeg_backend
+            rendition.jpeg_subsampling = self.config.jpeg_subsampling
+
+            self.sensors[path] = rendition
+            self.sensors_sorted["camera_rendition"].add(path)
+            camera.derived.append(path)
+
+            self.fox_wrap.add_channel(rendition)
+
+
+    def add_scene(self, tf_tree : IsaacSensor):
+        """Adds the scene channel, publishing the geometry under the TF root"""
+        path = tf_tree.path.rstrip("/") + "/scene"
+
+        scene = IsaacSensor("scene", path)
+        scene.source = tf_tree
+        scene.period = self.config.get_period("scene")
+
+        self.sensors[path] = scene
+        self.sensors_sorted["scene"].add(path)
+        tf_tree.derived.append(path)
+
+        self.fox_wrap.add_channel(scene)
+
+
     def set_cam_resolution(self, width : int, height : int):
         """Updates the resolution of existing and future cameras"""
         self.cam_width = width
@@ -358,22 +865,41 @@ class DataCollector():
         # Add new
         self.tf_root = new_tf_root
         self.add_sensor(omni.usd.get_context().get_stage().GetPrimAtPath(self.tf_root), tf=True)
+
+        # Rigid body states are expressed in the root frame
+        if "rigid_body" in self.readers:
+            self.readers["rigid_body"].set_root(omni.usd.get_context().get_stage().GetPrimAtPath(self.tf_root))
     
 
+    def sample_imus(self):
+        """Adds the current reading of the batched IMUs to their batch, called on every physics step"""
+        for path in self.sensors_sorted["imu"]:
+            sensor = self.sensors[path]
+            if sensor.batched and sensor.enabled and sensor.publish:
+                sensor.imu_sample()
+
+
     def collect_data(self):
-        data = dict()
-        
+        now = time.monotonic()
+        outbox = self.fox_wrap.outbox # Payloads are queued directly, without a per-step dict
+
         for sensor in self.sensors.values():
-            if sensor.enabled:
-                data[sensor.path] = sensor.collect()
-        
-        self.fox_wrap.send_message(data)
+            if sensor.enabled and sensor.publish:
+                if sensor.batched:
+                    sensor.imu_sample() # Every reading is kept, messages follow the publishing rate
+                if sensor.is_due(now):
+                    payload = sensor.collect(now)
+                    if payload:
+                        outbox.append((sensor.path, payload))
+                        sensor.published += 1
+
+        self.fox_wrap.flush()
     
 
     def cleanup(self):
         self.fox_wrap.close()
+        for sensor in self.sensors.values():
+            sensor.release()
         self.sensors = dict()
-        self.sensors_sorted = {"camera" : set(),
-                            "imu" : set(),
-                            "articulation" : set(),
-                            "tf_tree" : set()}
+        self.sensors_sorted = {sensor_type : set() for sensor_type in SENSOR_TYPES}
+        self.readers = dict()
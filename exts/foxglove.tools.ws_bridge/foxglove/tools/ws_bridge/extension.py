@@ -21,6 +21,7 @@ from omni.isaac.ui.menu import MenuItemDescription
 from omni.kit.menu.utils import add_menu_items, remove_menu_items
 from omni.usd import StageEventType
 
+from .timing import startup_budget
 from .ui_builder import UIBuilder
 
 import webbrowser
@@ -39,6 +40,7 @@ EXTENSION_TITLE = "Foxglove"
 
 
 class FoxgloveExtension(omni.ext.IExt):
+    @startup_budget("on_startup")
     def on_startup(self, ext_id: str):
         """Initialize extension and UI elements"""
 
@@ -2,9 +2,10 @@
 # https://github.com/foxglove/ws-protocol/tree/main/python/src/foxglove_websocket/examples
 
 import asyncio
-import json
+import threading
 import time
-import os
+from collections import deque
+from fnmatch import fnmatchcase
 
 from foxglove_websocket.server import FoxgloveServer, FoxgloveServerListener
 from foxglove_websocket.types import ChannelId
@@ -13,7 +14,10 @@ from foxglove_websocket.types import (
     ChannelId,
 )
 
+from .profiling import Profiler
 from .schemas import get_schema_for_sensor
+from .server import BridgeServer, CompressionPolicy, SendPriorities, compress_message
+from .server import PRIORITY_HIGH, PRIORITY_NORMAL
 
 # Terminal text formatting
 class Colors:
@@ -24,133 +28,496 @@ class Colors:
 
 def get_topic_for_sensor(sensor):
 
+    # Replayed channels keep the topic they were recorded on
+    if getattr(sensor, "topic", None):
+        return sensor.topic
+
     if sensor.type == "tf_tree":
         return "/tf"
 
+    if sensor.type == "scene":
+        return "/scene"
+
     suffix = ""
     if sensor.type == "articulation":
         suffix = "/joint_states"
+    elif sensor.type == "rigid_body":
+        suffix = "/state"
     # Add suffixes for future supported format here
     
     return sensor.path + suffix
 
 
-class FoxgloveWrapper():
+def get_sensor_parameters(sensors : dict, names : list = None):
+    """Returns the parameters of all sensors, named "<sensor path>.<setting>", optionally filtered by names"""
+    parameters = []
 
-    def __init__(self, data_collector):
-        self.data_collector = data_collector
+    for sensor in sensors.values():
+        for setting, value in sensor.get_parameters().items():
+            name = f"{sensor.path}.{setting}"
+            if not names or name in names:
+                parameters.append({"name": name, "value": value})
+
+    return parameters
+
+
+def set_sensor_parameters(sensors : dict, parameters : list):
+    """Applies parameters to their sensors and returns their updated values"""
+    for parameter in parameters:
+        path, _, setting = parameter["name"].rpartition(".")
+        if path in sensors:
+            sensors[path].set_parameter(setting, parameter["value"])
+
+    return get_sensor_parameters(sensors, [parameter["name"] for parameter in parameters])
+
+
+class MessageCache():
+    """Keeps the last payload sent on each channel, and optionally the last few seconds of them"""
+
+    def __init__(self, history_duration : float = 0.0):
+        self.history_duration = history_duration # Seconds of history kept per channel (0 = latest message only)
+        self._messages = dict() # Maps sensor paths to deques of (timestamp, payload)
+
+    def add(self, path : str, timestamp : int, payload : bytes):
+        messages = self._messages.get(path)
+        if messages is None:
+            messages = self._messages[path] = deque()
+
+        if self.history_duration <= 0:
+            messages.clear()
+        messages.append((timestamp, payload))
+
+        # Drop messages older than the history window, always keeping the latest one
+        oldest = timestamp - int(self.history_duration * 1e9)
+        while len(messages) > 1 and messages[0][0] < oldest:
+            messages.popleft()
+
+    def get(self, path : str):
+        """Returns the cached (timestamp, payload) pairs of a channel, oldest first"""
+        return list(self._messages.get(path, ()))
+
+    def remove(self, path : str):
+        self._messages.pop(path, None)
+
+    def clear(self):
+        self._messages = dict()
+
+
+class ServerShard():
+    """One Foxglove server, on its own thread, event loop and port, publishing the channels assigned to it"""
+
+    def __init__(self, fox_wrap, port : int, services : bool = False):
+        self.fox_wrap = fox_wrap
+        self.port = port
+        self.services = services # Whether the profiling services are advertised by this server
         self.server = None
 
+        # Sensors and USD are only accessed from Kit's loop (see FoxgloveWrapper.run_on_main_thread())
+        self.loop = None
+        self.thread = None
+        self.task = None
+
         self.path2channel = dict()  # Maps sensor paths to channel IDs
         self.channel2path = dict()  # Inverse map
+        self.path2priority = dict() # Maps sensor paths to their priority class (see SendPriorities)
+        self.latest_paths = set() # Paths whose waiting low priority payload is replaced by a newer one
+
+        # Collected (path, payload) pairs are handed over through two lists, swapped instead of allocating a new
+        # batch (and task) per physics step: pending (filled under the lock) and sending (drained by the server)
+        self.outbox = [] # Payloads routed to this server during the current step, when there are several
+        self._pending = []
+        self._sending = []
+        self._outbox_lock = threading.Lock()
+        self._outbox_ready = None
+
+        self._normal = [] # Normal priority messages of the tick being sent, after the high priority ones
+        self._deferred = deque() # Low priority (path, payload) pairs not sent yet, in arrival order
+        self._latest = dict() # Maps the latest_paths to their waiting payload, queued as (path, None) in _deferred
+
+    def start(self, sensors : dict, name : str):
+        self.loop = asyncio.new_event_loop()
+
+        # The loop is not running yet, so the task can be created from this thread
+        self.task = self.loop.create_task(self._run_server(sensors))
+        self.thread = threading.Thread(target=self.loop.run_until_complete, args=(self.task,), name=name, daemon=True)
+        self.thread.start()
 
-    def start(self, port: int, sensors : dict):
-        loop = asyncio.get_event_loop()
-        self.server_task = loop.create_task(self._run_server(port, sensors))
-    
     def close(self):
-        if self.server:
-            self.server_task.cancel()
+        if self.thread:
+            self.loop.call_soon_threadsafe(self.task.cancel)
+            self.thread.join(timeout=5.0)
+            if not self.thread.is_alive():
+                self.loop.close()
+
+            self.thread = None
             self.server = None
-            print(Colors.MAGENTA_BOLD + f"[Foxglove Info] Foxglove server closed" + Colors.RESET)
 
 
-    async def _run_server(self, port : int, sensors : dict):
+    def run_on_server_thread(self, coroutine):
+        """Schedules a coroutine on the server's event loop, from any thread"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+
+    async def _run_server(self, sensors : dict):
+        fox_wrap = self.fox_wrap
+        capabilities = ["parameters", "parametersSubscribe"] + (["services"] if self.services else [])
+
+        self._outbox_ready = asyncio.Event()
         try:
-            async with FoxgloveServer("0.0.0.0", port, "isaac sim server") as self.server:
-                self.server.set_listener(Listener(self.data_collector, self.channel2path))
+            async with BridgeServer("0.0.0.0", self.port, "isaac sim server",
+                                    capabilities=capabilities,
+                                    supported_encodings=["json"],
+                                    compression=fox_wrap.compression) as self.server:
+                self.server.set_listener(Listener(fox_wrap.data_collector, self.channel2path, fox_wrap.cache))
 
-                await self.init_channels(sensors)
+                await self.apply_channel_changes([("add", sensor) for sensor in sensors.values()])
+                if self.services:
+                    await fox_wrap.profiler.advertise(self.server)
 
-                print(Colors.MAGENTA_BOLD + f"[Foxglove Info] Foxglove server started at ws://0.0.0.0:{port}" + Colors.RESET)
+                print(Colors.MAGENTA_BOLD + f"[Foxglove Info] Foxglove server started at ws://0.0.0.0:{self.port}" + Colors.RESET)
 
                 while True:
-                    await asyncio.sleep(1)
+                    await self._outbox_ready.wait()
+                    self._outbox_ready.clear()
+                    try:
+                        await self._send_outbox()
+                    except Exception as e:
+                        print(f"[Error] Could not send messages: {e}")
 
         except asyncio.CancelledError:
             pass
 
 
-    async def init_channels(self, sensors : dict):
+    async def apply_channel_changes(self, changes : list):
+        # Only the last change of each path matters, e.g. a sensor removed and added again is re-advertised
+        final_changes = dict()
+        for change, target in changes:
+            path = target.path if change == "add" else target
+            final_changes[path] = (change, target)
+
+        removed = [path for path in final_changes if path in self.path2channel]
+        added = [target for change, target in final_changes.values() if change == "add"]
+
+        await self.server.remove_channels([self.path2channel[path] for path in removed])
+        for path in removed:
+            self.channel2path.pop(self.path2channel.pop(path))
+            self.path2priority.pop(path, None)
+            self.latest_paths.discard(path)
+            self._latest.pop(path, None)
+            self.fox_wrap.cache.remove(path)
+
+        channels = []
+        for sensor in added:
+            schema_name, schema, encoding, schema_encoding = get_schema_for_sensor(sensor)
+            channels.append({
+                "topic": get_topic_for_sensor(sensor),
+                "encoding": encoding,
+                "schemaName": schema_name,
+                "schema": schema,
+                "schemaEncoding": schema_encoding,
+            })
+
+        for sensor, chan_id in zip(added, await self.server.add_channels(channels)):
+            self.path2channel[sensor.path] = chan_id
+            self.channel2path[chan_id] = sensor.path
+            self.path2priority[sensor.path] = self.fox_wrap.priorities.for_type(sensor.type)
+            if self.fox_wrap.priorities.keeps_latest_only(sensor.type):
+                self.latest_paths.add(sensor.path)
 
-        curr_dir = os.path.dirname(os.path.abspath(__file__))
-        schema_path = os.path.join(curr_dir, 'json_schemas/')
 
-        for sensor in sensors.values():
-            await self._add_channel(sensor)
+    def hand_over(self, payloads : list):
+        """Passes the payloads of a physics step to the server thread, returns an empty list to fill next"""
+        if not self.server:
+            payloads.clear()
+            return payloads
 
+        with self._outbox_lock:
+            wake_up = not self._pending
+            if wake_up:
+                payloads, self._pending = self._pending, payloads
+            else:
+                # The server thread has not picked up the previous steps yet
+                self._pending.extend(payloads)
+                payloads.clear()
 
-    def add_channel(self, sensor):
+        if wake_up:
+            self.loop.call_soon_threadsafe(self._outbox_ready.set)
+        return payloads
 
-        curr_dir = os.path.dirname(os.path.abspath(__file__))
-        schema_path = os.path.join(curr_dir, 'json_schemas/')
+    def get_backlog(self):
+        return len(self._pending) + len(self._sending) + len(self._deferred)
 
-        loop = asyncio.get_event_loop()
-        if self.server:
-            loop.create_task(self._add_channel(sensor))
 
+    async def _send_outbox(self):
+        with self._outbox_lock:
+            self._pending, self._sending = self._sending, self._pending
+
+        # High priority messages are sent first, then the normal ones, then the low ones within the byte budget
+        try:
+            for item in self._sending:
+                priority = self.path2priority.get(item[0], PRIORITY_NORMAL)
+                if priority == PRIORITY_HIGH:
+                    await self._send(*item)
+                elif priority == PRIORITY_NORMAL:
+                    self._normal.append(item)
+                elif item[0] in self.latest_paths:
+                    # A newer payload replaces the one still waiting, which keeps its place in the queue
+                    if item[0] not in self._latest:
+                        self._deferred.append((item[0], None))
+                    self._latest[item[0]] = item[1]
+                else:
+                    self._deferred.append(item)
+
+            for item in self._normal:
+                await self._send(*item)
+        finally:
+            self._sending.clear()
+            self._normal.clear()
+
+        budget = self.fox_wrap.priorities.budget
+        sent = 0
+        while self._deferred and (budget <= 0 or sent < budget):
+            path, payload = self._deferred.popleft()
+            if payload is None:
+                payload = self._latest.pop(path, None)
+                if payload is None:
+                    continue # The channel was removed meanwhile
+            await self._send(path, payload)
+            sent += len(payload)
+
+        # The rest is sent on the next tick, after the higher priority messages collected meanwhile
+        if self._deferred:
+            self._outbox_ready.set()
+
+    async def _send(self, path : str, payload : bytes):
+        if self.server and path in self.path2channel:
+            compress_message.set(self.fox_wrap.should_compress(path, payload))
+            timestamp = time.time_ns()
+            await self.server.send_message(
+                self.path2channel[path],
+                timestamp,
+                payload,
+            )
+            self.fox_wrap.cache.add(path, timestamp, payload)
 
-    async def _add_channel(self, sensor):
 
-        schema_name, schema, encoding, schema_encoding = get_schema_for_sensor(sensor)
-        topic_name = get_topic_for_sensor(sensor)
-        
-        self.path2channel[sensor.path] = await self.server.add_channel(
-            {
-                "topic": topic_name,
-                "encoding": encoding,
-                "schemaName": schema_name,
-                "schema": schema,
-                "schemaEncoding": schema_encoding,
-            }
-        )
-        self.channel2path[self.path2channel[sensor.path]] = sensor.path
 
+class FoxgloveWrapper():
+
+    def __init__(self, data_collector, history_duration : float = 0.0, compression : CompressionPolicy = None,
+                 shards : list = None, priorities : SendPriorities = None):
+        self.data_collector = data_collector
+
+        # The servers run on their own threads and event loops, so that network I/O does not stall Kit's update loop.
+        # The first one publishes every channel not assigned to another shard by the rules (see get_shard_index())
+        self.main_loop = None
+        self.closing = False # Set while the servers shut down, when Kit's loop is blocked joining their threads
+        self._main_calls = set() # Calls of the server threads waiting for Kit's loop, cancelled on close
+        self.shard_rules = shards or []
+        self.shards = []
+        self.path2shard = dict() # Maps sensor paths to the ServerShards publishing them
+
+        # Channel changes ("add", sensor) / ("remove", path) made during one pass of Kit's loop (e.g. a stage diff),
+        # advertised together (see commit_channels())
+        self._channel_changes = []
+        self._commit_scheduled = False
+
+        self.cache = MessageCache(history_duration) # Replayed to clients when they subscribe
+        self.compression = compression or CompressionPolicy()
+        self.priorities = priorities or SendPriorities()
+        self.profiler = Profiler(self) # Captures started from Foxglove through the /profiling services
+
+        self.outbox = [] # (path, payload) pairs collected during the current physics step, see flush()
+
+    @property
+    def server(self):
+        """Server of the main shard, None when it is not running"""
+        return self.shards[0].server if self.shards else None
+
+    def start(self, port: int, sensors : dict):
+        self.main_loop = asyncio.get_event_loop()
+        self.closing = False
+
+        self.shards = [ServerShard(self, port, services=True)]
+        for index, rule in enumerate(self.shard_rules, start=1):
+            self.shards.append(ServerShard(self, rule.get("port", port + index)))
+
+        shard_sensors = [dict() for _ in self.shards]
+        for path, sensor in sensors.items():
+            index = self.get_shard_index(sensor)
+            shard_sensors[index][path] = sensor
+            self.path2shard[path] = self.shards[index]
+
+        for index, shard in enumerate(self.shards):
+            shard.start(shard_sensors[index], "Foxglove server" if index == 0 else f"Foxglove server {index}")
     
+    def close(self):
+        if self.shards:
+            # The connections closed on shutdown unsubscribe their channels: the sensors are disabled here, on Kit's
+            # thread, as the server threads cannot wait for Kit's loop while it joins them
+            self.closing = True
+            for future in list(self._main_calls):
+                future.cancel()
+            for sensor in self.data_collector.sensors.values():
+                if sensor.enabled:
+                    sensor.disable()
+
+            for shard in self.shards:
+                shard.close()
+            self.profiler.cancel()
+
+            self.shards = []
+            self.path2shard = dict()
+            self.cache.clear()
+            print(Colors.MAGENTA_BOLD + f"[Foxglove Info] Foxglove server closed" + Colors.RESET)
+
+    def get_ports(self):
+        return [shard.port for shard in self.shards]
+
+    def get_shard_index(self, sensor):
+        """Shard publishing a sensor: the first rule matching its type or path, 0 (the main server) otherwise"""
+        for index, rule in enumerate(self.shard_rules, start=1):
+            if sensor.type in rule.get("types", ()) \
+                    or any(fnmatchcase(sensor.path, pattern) for pattern in rule.get("paths", ())):
+                return index
+        return 0
+
+
+    async def run_on_main_thread(self, function, *args):
+        """Calls function on Kit's event loop and returns its result, from a server thread"""
+        async def call():
+            return function(*args)
+
+        if self.closing:
+            raise asyncio.CancelledError()
+
+        future = asyncio.run_coroutine_threadsafe(call(), self.main_loop)
+        self._main_calls.add(future)
+        try:
+            return await asyncio.wrap_future(future)
+        finally:
+            self._main_calls.discard(future)
+
+
+    def add_channel(self, sensor):
+        self._queue_channel_change("add", sensor)
+
     def remove_channel(self, sensor_path : str):
-        loop = asyncio.get_event_loop()
-        if self.server:
-            loop.create_task(self._remove_channel(sensor_path))
+        self._queue_channel_change("remove", sensor_path)
 
+    def _queue_channel_change(self, change : str, target):
+        if not self.server:
+            return
 
-    async def _remove_channel(self, sensor_path : str):
-        await self.server.remove_channel(self.path2channel[sensor_path])
-        chan_id = self.path2channel.pop(sensor_path)
-        self.channel2path.pop(chan_id)
+        self._channel_changes.append((change, target))
 
+        # Committed once the current pass of Kit's loop is over, so that a whole stage diff is sent at once
+        if not self._commit_scheduled:
+            self._commit_scheduled = True
+            asyncio.get_event_loop().call_soon(self.commit_channels)
 
-    def send_message(self, data : dict):
-        loop = asyncio.get_event_loop()
-        if self.server:
-            loop.create_task(self._send_message(data))
-            
+    def commit_channels(self):
+        """Sends the queued channel changes to the server threads, as one advertise and one unadvertise per server"""
+        self._commit_scheduled = False
+        changes, self._channel_changes = self._channel_changes, []
+        if not changes or not self.server:
+            return
+
+        shard_changes = {shard : [] for shard in self.shards}
+        for change, target in changes:
+            if change == "add":
+                shard = self.path2shard[target.path] = self.shards[self.get_shard_index(target)]
+            else:
+                shard = self.path2shard.pop(target, self.shards[0])
+            shard_changes[shard].append((change, target))
 
-    async def _send_message(self, data : dict):
+        for shard, changes in shard_changes.items():
+            if changes:
+                shard.run_on_server_thread(shard.apply_channel_changes(changes))
+
+
+    def send_message(self, data : dict):
         for path, payload in data.items():
-            if self.server and payload:
-                await self.server.send_message(
-                    self.path2channel[path],
-                    time.time_ns(),
-                    payload,
-                )
+            if payload:
+                self.outbox.append((path, payload))
+        self.flush()
+
+    def flush(self):
+        """Hands the payloads of a physics step over to the server threads"""
+        if not self.server or not self.outbox:
+            self.outbox.clear()
+            return
+
+        if len(self.shards) == 1:
+            self.outbox = self.shards[0].hand_over(self.outbox)
+            return
+
+        main_shard = self.shards[0]
+        for item in self.outbox:
+            self.path2shard.get(item[0], main_shard).outbox.append(item)
+        self.outbox.clear()
+
+        for shard in self.shards:
+            if shard.outbox:
+                shard.outbox = shard.hand_over(shard.outbox)
+
+    def get_backlog(self):
+        """Number of payloads handed over to the server threads and not sent yet"""
+        return sum(shard.get_backlog() for shard in self.shards)
+
+
+    def should_compress(self, path : str, payload : bytes):
+        sensor = self.data_collector.sensors.get(path)
+        policy = self.compression.for_channel(path, sensor.type) if sensor else "auto"
+        return self.compression.should_compress(policy, len(payload))
 
     
 
 class Listener(FoxgloveServerListener):
+    """Server callbacks, called on the server thread: sensors are only accessed through Kit's event loop"""
 
-    def __init__(self, data_collector, channel2path : dict):
+    def __init__(self, data_collector, channel2path : dict, cache : MessageCache):
         self.data_collector = data_collector
+        self.fox_wrap = data_collector.fox_wrap
         self.channel2path = channel2path
+        self.cache = cache
 
     async def on_subscribe(self, server: FoxgloveServer, channel_id: ChannelId):
+        if self.fox_wrap.closing:
+            return
         path = self.channel2path[channel_id]
         topic = get_topic_for_sensor(self.data_collector.sensors[path])
-        self.data_collector.sensors[path].enable()
+        await self.fox_wrap.run_on_main_thread(self.data_collector.sensors[path].enable)
         print(Colors.MAGENTA_BOLD + f"[Foxglove Info] First client subscribed to {topic}" + Colors.RESET)
 
+    async def on_client_subscribe(self, server: BridgeServer, client, sub_id, channel_id: ChannelId):
+        # Send the cached messages to the new subscriber right away instead of waiting for the next collection
+        # (e.g. the scene geometry, which is only published again when it changes)
+        path = self.channel2path.get(channel_id)
+
+        # Channels publishing changes only (the scene) provide their whole state instead
+        snapshot = getattr(self.data_collector.sensors.get(path), "snapshot", None)
+        messages = [(time.time_ns(), snapshot)] if snapshot else self.cache.get(path)
+
+        for timestamp, payload in messages:
+            compress_message.set(self.fox_wrap.should_compress(path, payload))
+            await server.send_to_client(client, sub_id, timestamp, payload)
+
     async def on_unsubscribe(self, server: FoxgloveServer, channel_id: ChannelId):
+        if self.fox_wrap.closing:
+            return # Already disabled by FoxgloveWrapper.close()
         path = self.channel2path[channel_id]
-        if path in self.data_collector.sensors:
-            topic = get_topic_for_sensor(self.data_collector.sensors[path])
-            self.data_collector.sensors[path].disable()
+        sensor = self.data_collector.sensors.get(path)
+        if sensor:
+            topic = get_topic_for_sensor(sensor)
+            await self.fox_wrap.run_on_main_thread(sensor.disable)
             print(Colors.MAGENTA_BOLD + f"[Foxglove Info] Last client unsubscribed from {topic}" + Colors.RESET)
+
+    async def on_get_parameters(self, server: FoxgloveServer, param_names: list, request_id):
+        return await self.fox_wrap.run_on_main_thread(get_sensor_parameters, self.data_collector.sensors, param_names)
+
+    async def on_set_parameters(self, server: FoxgloveServer, params: list, request_id):
+        return await self.fox_wrap.run_on_main_thread(set_sensor_parameters, self.data_collector.sensors, params)
+
+    async def on_service_request(self, server: FoxgloveServer, service_id, call_id, encoding: str, payload: bytes):
+        return await self.fox_wrap.profiler.handle_request(service_id, payload)
@@ -0,0 +1,140 @@
+# JPEG encoders of the camera frames. simplejpeg (libjpeg-turbo, SIMD) encodes straight from the RGBA buffer
+# of the camera and returns the JPEG bytes without intermediate copies; PIL is the fallback when it is missing.
+# Benchmark of the available backends, run from the extension folder (exts/foxglove.tools.ws_bridge):
+#
+#   python -m foxglove.tools.ws_bridge.jpeg
+
+import argparse
+import io
+import time
+
+import numpy as np
+
+
+# Chroma subsampling -> PIL's "subsampling" option
+PIL_SUBSAMPLING = {"444" : 0, "422" : 1, "420" : 2}
+
+BENCHMARK_RESOLUTIONS = [(320, 240), (640, 480), (1280, 720), (1920, 1080)]
+
+
+class PillowEncoder():
+    """Encodes through PIL, into a BytesIO reused between frames"""
+
+    name = "pillow"
+
+    def __init__(self):
+        from PIL import Image
+        self._image = Image
+        self._buffer = io.BytesIO()
+
+    def encode(self, frame : np.ndarray, quality : int = 75, subsampling : str = "420"):
+        """JPEG bytes of an (H, W, 3) RGB or (H, W, 4) RGBA frame"""
+        image = self._image.fromarray(frame[..., :3] if frame.shape[-1] == 4 else frame)
+
+        # The buffer keeps its capacity: it is overwritten from the start instead of being truncated
+        self._buffer.seek(0)
+        image.save(self._buffer, format="jpeg", quality=quality, subsampling=PIL_SUBSAMPLING[subsampling])
+        with self._buffer.getbuffer() as jpeg:
+            return bytes(jpeg[:self._buffer.tell()])
+
+
+class SimpleJpegEncoder():
+    """Encodes with libjpeg-turbo through simplejpeg, reading the RGB(A) frame in place"""
+
+    name = "simplejpeg"
+
+    def __init__(self):
+        import simplejpeg
+        self._encode_jpeg = simplejpeg.encode_jpeg
+
+    def encode(self, frame : np.ndarray, quality : int = 75, subsampling : str = "420"):
+        """JPEG bytes of an (H, W, 3) RGB or (H, W, 4) RGBA frame"""
+        if not frame.flags.c_contiguous:
+            frame = np.ascontiguousarray(frame)
+
+        # The alpha channel is skipped by libjpeg-turbo itself, without converting the frame to RGB first
+        colorspace = "RGBX" if frame.shape[-1] == 4 else "RGB"
+        return self._encode_jpeg(frame, quality=quality, colorspace=colorspace, colorsubsampling=subsampling)
+
+
+# Backends by order of preference, for "auto"
+JPEG_BACKENDS = {"simplejpeg" : SimpleJpegEncoder,
+                 "pillow" : PillowEncoder}
+
+_unavailable = set() # Backends whose import failed, reported once
+
+
+def create_encoder(backend : str = "auto"):
+    """Encoder of the given backend ("auto" = the fastest available), falling back to PIL"""
+    names = list(JPEG_BACKENDS) if backend == "auto" else [backend, "pillow"]
+
+    for name in names:
+        if name not in JPEG_BACKENDS:
+            print(f"[Error] Unknown JPEG backend \"{name}\"")
+            continue
+        if name in _unavailable:
+            continue
+
+        try:
+            return JPEG_BACKENDS[name]()
+        except ImportError:
+            _unavailable.add(name)
+            if name == backend:
+                print(f"[Warning] JPEG backend \"{name}\" is not installed, falling back to PIL")
+
+    return PillowEncoder()
+
+
+def generate_frame(width : int, height : int):
+    """Noisy RGBA gradient, costing about as much to encode as a rendered frame"""
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[np.newaxis, :, np.newaxis]
+    frame = np.full((height, width, 4), 255, dtype=np.uint8)
+    frame[..., :3] = np.clip(gradient + rng.normal(0, 16, (height, width, 3)), 0, 255)
+    return frame
+
+
+def benchmark(quality : int = 75, subsampling : str = "420", duration : float = 1.0):
+    """Encoding time per frame of each installed backend, per resolution"""
+    encoders, missing = [], []
+    for name, encoder_class in JPEG_BACKENDS.items():
+        try:
+            encoders.append(encoder_class())
+        except ImportError:
+            missing.append(name)
+
+    print(f"JPEG encoding of RGBA frames, quality {quality}, {subsampling} subsampling\n")
+    print(f"{'resolution':<12}" + "".join(f"{encoder.name + ' ms':>16}" for encoder in encoders)
+          + f"{'speedup':>10}")
+
+    for width, height in BENCHMARK_RESOLUTIONS:
+        frame = generate_frame(width, height)
+        times = dict()
+        for encoder in encoders:
+            encoder.encode(frame, quality, subsampling) # Warm-up
+            count, start = 0, time.perf_counter()
+            while (elapsed := time.perf_counter() - start) < duration:
+                encoder.encode(frame, quality, subsampling)
+                count += 1
+            times[encoder.name] = elapsed / count * 1e3
+
+        # Gain of the fastest backend over PIL
+        speedup = times["pillow"] / min(times.values())
+        print(f"{f'{width}x{height}':<12}" + "".join(f"{ms:>16.2f}" for ms in times.values()) + f"{speedup:>9.1f}x")
+
+    if missing:
+        print(f"\nNot installed: {', '.join(missing)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the JPEG encoders of the camera frames")
+    parser.add_argument("--quality", type=int, default=75)
+    parser.add_argument("--subsampling", choices=list(PIL_SUBSAMPLING), default="420")
+    parser.add_argument("--duration", type=float, default=1.0, help="Seconds per backend and resolution")
+    args = parser.parse_args()
+
+    benchmark(args.quality, args.subsampling, args.duration)
+
+
+if __name__ == "__main__":
+    main()
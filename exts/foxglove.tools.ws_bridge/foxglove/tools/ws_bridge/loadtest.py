@@ -0,0 +1,411 @@
+# Synthetic load generator and headless client, to measure the bridge throughput without Isaac Sim.
+# Run from the extension folder (exts/foxglove.tools.ws_bridge):
+#
+#   python -m foxglove.tools.ws_bridge.loadtest --cameras 4 --imus 8 --articulations 2 --tf-frames 200
+#
+# The regular DataCollector and IsaacSensor run on a synthetic stage (see synthetic.py), whose cameras, IMUs,
+# articulations and frames produce readings of the same types and sizes as the Isaac ones. Headless clients subscribe
+# to every channel and report the achieved message rates, bandwidth, drop rates and latency percentiles. Each client
+# runs in its own process, so that the measurements are not skewed by the clients competing with the bridge for its
+# event loop and GIL.
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import struct
+import time
+
+import websockets
+
+from . import synthetic
+from .config import BridgeConfig
+from .foxglove_wrapper import get_topic_for_sensor
+from .jpeg import JPEG_BACKENDS
+
+
+MESSAGE_DATA_HEADER = struct.Struct("<BIQ") # opcode, subscription id, timestamp
+
+CLIENT_START_TIMEOUT = 30.0 # Seconds for the client processes to start and subscribe, after the warm-up
+
+# Files defining collect_data(): the blocks allocated under it (collection and hand-over to the servers) are counted
+STEP_FILES = ["data_collection.py"]
+
+ALLOCATION_BUDGET = 2 # Blocks allocated per step besides the payloads, and still alive when the step ends
+NUMBER_SIZE = 48 # Blocks smaller than this are boxed ints and floats (counters, values written in reused messages)
+
+
+def create_collector(config : BridgeConfig, cameras : int = 1, imus : int = 1, articulations : int = 1,
+                     joints : int = 12, tf_frames : int = 50):
+    """DataCollector reading the sensors of a synthetic stage, through the stand-ins of the Isaac Sim modules"""
+    synthetic.install(synthetic.Stage(cameras=cameras, imus=imus, articulations=articulations, joints=joints,
+                                      tf_frames=tf_frames))
+    from .data_collection import DataCollector # Imports omni and pxr, i.e. the stand-ins
+
+    collector = DataCollector(config)
+    collector.init_sensors()
+    return collector
+
+
+
+class TopicStats():
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.latencies = [] # Nanoseconds between the server timestamp and the reception
+
+
+class HeadlessClient():
+    """Subscribes to every advertised channel and measures what it receives"""
+
+    def __init__(self, url : str):
+        self.url = url
+        self.subscriptions = dict() # Maps subscription IDs to topics
+        self.stats = dict() # Maps topics to TopicStats
+        self.recording = False
+
+    async def run(self, duration : float = None, connect_timeout : float = 5.0):
+        """Receives messages for duration seconds, or until cancelled"""
+        deadline = time.monotonic() + connect_timeout
+        while True:
+            try:
+                connection = await websockets.connect(self.url, subprotocols=["foxglove.websocket.v1"],
+                                                      max_size=None, compression="deflate")
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+        async with connection:
+            end = time.monotonic() + duration if duration is not None else None
+            while end is None or (remaining := end - time.monotonic()) > 0:
+                try:
+                    message = await asyncio.wait_for(connection.recv(), remaining if end is not None else None)
+                except asyncio.TimeoutError:
+                    break
+
+                if isinstance(message, str):
+                    await self._on_json(connection, json.loads(message))
+                else:
+                    self._on_binary(message)
+
+    async def _on_json(self, connection, message : dict):
+        if message["op"] == "advertise":
+            subscriptions = []
+            for channel in message["channels"]:
+                sub_id = len(self.subscriptions)
+                self.subscriptions[sub_id] = channel["topic"]
+                self.stats[channel["topic"]] = TopicStats()
+                subscriptions.append({"id": sub_id, "channelId": channel["id"]})
+
+            await connection.send(json.dumps({"op": "subscribe", "subscriptions": subscriptions}))
+
+    def _on_binary(self, message : bytes):
+        received = time.time_ns()
+        opcode, sub_id, timestamp = MESSAGE_DATA_HEADER.unpack_from(message)
+
+        if opcode == 1 and self.recording:
+            stats = self.stats[self.subscriptions[sub_id]]
+            stats.count += 1
+            stats.bytes += len(message) - MESSAGE_DATA_HEADER.size
+            stats.latencies.append(received - timestamp)
+
+
+
+async def run_clients(urls : list, recording, stop, ready):
+    """Runs a headless client per URL until stop is set, recording while recording is set. Returns their stats"""
+    clients = [HeadlessClient(url) for url in urls]
+    tasks = [asyncio.ensure_future(client.run(connect_timeout=CLIENT_START_TIMEOUT)) for client in clients]
+
+    subscribed = False
+    while not stop.is_set() and not all(task.done() for task in tasks):
+        for client in clients:
+            client.recording = recording.is_set()
+
+        if not subscribed and all(client.subscriptions for client in clients):
+            subscribed = True
+            with ready.get_lock():
+                ready.value += 1
+        await asyncio.sleep(0.01)
+
+    for task in tasks:
+        task.cancel()
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(result, Exception) and not isinstance(result, asyncio.CancelledError):
+            print(f"[Error] Headless client failed: {result!r}")
+
+    # The servers of the URLs publish different topics
+    return {topic: (stats.count, stats.bytes, stats.latencies)
+            for client in clients for topic, stats in client.stats.items()}
+
+
+def run_client_process(urls : list, recording, stop, ready, results):
+    """Entry point of a client process, sending the stats of its clients through the results queue"""
+    logging.getLogger("websockets").setLevel(logging.WARNING)
+    results.put(asyncio.run(run_clients(urls, recording, stop, ready)))
+
+
+def start_client_processes(urls : list, count : int):
+    """Starts count client processes, each connecting to every URL"""
+    context = multiprocessing.get_context("spawn") # The bridge's server threads must not be forked
+    recording, stop, ready, results = context.Event(), context.Event(), context.Value("i", 0), context.Queue()
+
+    processes = [context.Process(target=run_client_process, args=(urls, recording, stop, ready, results),
+                                 name=f"Headless client {i}", daemon=True) for i in range(count)]
+    for process in processes:
+        process.start()
+
+    return processes, recording, stop, ready, results
+
+
+def collect_client_stats(processes : list, stop, results, timeout : float = 10.0):
+    """Stops the client processes and returns their stats, as dicts mapping topics to TopicStats"""
+    stop.set()
+    client_stats = []
+    for _ in processes:
+        stats = dict()
+        for topic, (count, size, latencies) in results.get(timeout=timeout).items():
+            stats[topic] = TopicStats()
+            stats[topic].count, stats[topic].bytes, stats[topic].latencies = count, size, latencies
+        client_stats.append(stats)
+
+    for process in processes:
+        process.join(timeout=timeout)
+    return client_stats
+
+
+
+async def run_physics(collector, physics_rate : float, duration : float, step_times : list = None):
+    """Calls collect_data() at the physics rate, like the physics step callback does, for duration seconds of wall
+    time. Returns the achieved rate, and adds the duration of each step to step_times"""
+    period = 1.0 / physics_rate
+    start = next_step = time.monotonic()
+    steps = 0
+
+    while time.monotonic() - start < duration:
+        step_start = time.perf_counter()
+        collector.collect_data()
+        steps += 1
+        if step_times is not None:
+            step_times.append(time.perf_counter() - step_start)
+
+        next_step += period
+        await asyncio.sleep(max(next_step - time.monotonic(), 0))
+
+    return steps / (time.monotonic() - start)
+
+
+def get_published_count(collector):
+    """Messages published so far by the sensors of a DataCollector"""
+    return sum(sensor.published for sensor in collector.sensors.values())
+
+
+async def measure_allocations(collector, physics_rate : float, steps : int):
+    """Allocations of each collect_data() call: the blocks still alive when it returns (containers and buffers, boxed
+    numbers, and the payloads published) summed over the steps with their sites, and the bytes it allocated at its
+    peak besides the payloads, per step, including the blocks freed before it returns (readings, encoding buffers)"""
+    import tracemalloc
+    filters = [tracemalloc.Filter(True, f"*{file_name}", all_frames=True) for file_name in STEP_FILES]
+    period = 1.0 / physics_rate
+    fox_wrap = collector.fox_wrap
+    flush = fox_wrap.flush
+    blocks, numbers, payloads, peaks = 0, 0, 0, []
+    sites = dict()
+    step_payload = 0
+
+    def measured_flush():
+        nonlocal step_payload
+        step_payload = sum(len(payload) for _, payload in fox_wrap.outbox)
+        flush()
+
+    fox_wrap.flush = measured_flush # Payloads are only sized, and handed over as usual
+    tracemalloc.start(32) # Deep enough for the allocations made under collect_data() to include its frame
+    try:
+        for _ in range(steps):
+            published = get_published_count(collector)
+            step_payload = 0
+
+            # Traces only hold the blocks allocated since they were cleared, and not freed yet: so does the peak
+            tracemalloc.clear_traces()
+            start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            collector.collect_data()
+            peaks.append(tracemalloc.get_traced_memory()[1] - start - step_payload)
+            snapshot = tracemalloc.take_snapshot().filter_traces(filters)
+
+            payloads += get_published_count(collector) - published
+            for trace in snapshot.traces:
+                if trace.size < NUMBER_SIZE:
+                    numbers += 1
+                else:
+                    blocks += 1
+                    site = str(trace.traceback[-1])
+                    sites[site] = sites.get(site, 0) + 1
+
+            await asyncio.sleep(period)
+    finally:
+        tracemalloc.stop()
+        del fox_wrap.flush
+
+    return blocks, numbers, payloads, sites, peaks
+
+
+def print_allocations(blocks : int, numbers : int, payloads : int, sites : dict, peaks : list, steps : int):
+    # Each published payload is one bytes object, handed over to the server threads
+    extra = max(blocks - payloads, 0) / steps
+    result = "OK" if extra <= ALLOCATION_BUDGET else "over budget"
+
+    # The peaks grow with the encoded frames and the JSON payloads, so they are reported without a budget
+    print(f"\nAllocations of {steps} steps, per step: {blocks / steps:.2f} blocks alive at the end for "
+          f"{payloads / steps:.2f} payloads, {numbers / steps:.2f} boxed numbers, {extra:.2f} extra blocks "
+          f"({result}, budget {ALLOCATION_BUDGET} blocks), and {percentile(peaks, 0.5) / 1e3:.2f} kB allocated "
+          f"at the peak besides the payloads (p99 {percentile(peaks, 0.99) / 1e3:.2f} kB)")
+    for site, count in sorted(sites.items(), key=lambda item: -item[1])[:5]:
+        print(f"  {site}: {count / steps:.2f} blocks per step")
+
+    return extra <= ALLOCATION_BUDGET
+
+
+def percentile(values : list, q : float):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def print_report(sensors : dict, client_stats : list, published : dict, duration : float,
+                 physics_rate : float, target_rate : float, step_times : list):
+    print(f"\nProducer: {physics_rate:.1f} Hz of {target_rate:.1f} Hz, collect_data() "
+          f"p50 {percentile(step_times, 0.5) * 1e3:.2f} ms, p99 {percentile(step_times, 0.99) * 1e3:.2f} ms")
+    print(f"{len(client_stats)} client process(es), {duration:.1f} s measured\n")
+    print(f"{'topic':<32}{'msgs/s':>10}{'kB/s':>12}{'drops':>9}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}")
+
+    total_count, total_bytes = 0, 0
+    for path, sensor in sorted(sensors.items()):
+        topic = get_topic_for_sensor(sensor)
+        topic_stats = [stats[topic] for stats in client_stats if topic in stats]
+
+        count = sum(stats.count for stats in topic_stats)
+        size = sum(stats.bytes for stats in topic_stats)
+        latencies = [latency for stats in topic_stats for latency in stats.latencies]
+        expected = published[path] * len(topic_stats)
+        drops = max(1 - count / expected, 0) if expected else 0.0
+
+        total_count += count
+        total_bytes += size
+        print(f"{topic:<32}{count / duration:>10.1f}{size / duration / 1e3:>12.1f}{drops:>9.1%}"
+              f"{percentile(latencies, 0.5) / 1e6:>10.2f}{percentile(latencies, 0.9) / 1e6:>10.2f}"
+              f"{percentile(latencies, 0.99) / 1e6:>10.2f}")
+
+    print(f"\n{'total':<32}{total_count / duration:>10.1f}{total_bytes / duration / 1e3:>12.1f}")
+
+
+async def run_load_test(args):
+    config = BridgeConfig(port=args.port,
+                          cam_width=args.cam_width,
+                          cam_height=args.cam_height,
+                          rates={"camera": args.camera_rate,
+                                 "imu": args.imu_rate,
+                                 "articulation": args.joint_rate,
+                                 "tf_tree": args.tf_rate},
+                          compression=not args.no_compression,
+                          imu_batch_rate=args.imu_batch_rate,
+                          jpeg_backend=args.jpeg_backend,
+                          jpeg_subsampling=args.jpeg_subsampling,
+                          shards=[{"types": ["camera"]}] if args.camera_shard else None,
+                          priorities=dict.fromkeys(["camera", "imu", "articulation", "tf_tree"], "normal")
+                                     if args.no_priorities else None,
+                          send_budget=args.send_budget,
+                          latest_only=args.latest_only)
+
+    collector = create_collector(config, cameras=args.cameras, imus=args.imus, articulations=args.articulations,
+                                 joints=args.joints, tf_frames=args.tf_frames)
+    collector.fox_wrap.start(config.port, collector.sensors)
+
+    # With shards, each client connects to every server
+    urls = [f"ws://localhost:{port}" for port in collector.fox_wrap.get_ports()]
+    processes, recording, stop, ready, results = start_client_processes(urls, args.clients)
+
+    try:
+        # Only measure once every client is subscribed and the bridge is in a steady state
+        warmup_end = time.monotonic() + args.warmup
+        while time.monotonic() < warmup_end or ready.value < args.clients:
+            if time.monotonic() > warmup_end + CLIENT_START_TIMEOUT:
+                raise TimeoutError(f"{ready.value} of {args.clients} clients subscribed")
+            await run_physics(collector, args.physics_rate, 0.1)
+
+        recording.set()
+        await asyncio.sleep(0.05) # The clients poll the event, and receive the messages in flight meanwhile
+        published_start = {path: sensor.published for path, sensor in collector.sensors.items()}
+        start = time.monotonic()
+
+        step_times = []
+        physics_rate = await run_physics(collector, args.physics_rate, args.duration, step_times)
+        duration = time.monotonic() - start
+        published = {path: sensor.published - published_start[path] for path, sensor in collector.sensors.items()}
+        await asyncio.sleep(0.2) # Messages of the last steps are still being sent
+        recording.clear()
+
+        allocations = None
+        trace_steps = max(int(args.trace_allocations * args.physics_rate), 1)
+        if args.trace_allocations > 0:
+            allocations = await measure_allocations(collector, args.physics_rate, trace_steps)
+
+        client_stats = collect_client_stats(processes, stop, results)
+
+    finally:
+        stop.set()
+        sensors = dict(collector.sensors) # Cleared by cleanup()
+        collector.cleanup()
+
+    print_report(sensors, client_stats, published, duration, physics_rate, args.physics_rate, step_times)
+
+    if allocations is not None:
+        return print_allocations(*allocations, trace_steps)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic load test of the Foxglove bridge")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cameras", type=int, default=2)
+    parser.add_argument("--cam-width", type=int, default=640)
+    parser.add_argument("--cam-height", type=int, default=480)
+    parser.add_argument("--imus", type=int, default=4)
+    parser.add_argument("--articulations", type=int, default=2)
+    parser.add_argument("--joints", type=int, default=12, help="Joints per articulation")
+    parser.add_argument("--tf-frames", type=int, default=100, help="Frames in the transform tree (0 = no /tf)")
+    parser.add_argument("--physics-rate", type=float, default=60.0, help="Rate of collect_data() calls (Hz)")
+    parser.add_argument("--camera-rate", type=float, default=30.0, help="0 = every physics step")
+    parser.add_argument("--imu-rate", type=float, default=0.0, help="0 = every physics step")
+    parser.add_argument("--joint-rate", type=float, default=0.0, help="0 = every physics step")
+    parser.add_argument("--imu-batch-rate", type=float, default=0.0, help="0 = IMU readings are not batched")
+    parser.add_argument("--tf-rate", type=float, default=30.0, help="0 = every physics step")
+    parser.add_argument("--clients", type=int, default=1)
+    parser.add_argument("--no-priorities", action="store_true", help="Send the messages in collection order")
+    parser.add_argument("--send-budget", type=int, default=262144,
+                        help="Bytes of low priority messages (cameras) sent per tick (0 = unlimited)")
+    parser.add_argument("--latest-only", nargs="*", default=[], metavar="TYPE",
+                        help="Sensor types whose stale low priority messages are dropped, e.g. camera")
+    parser.add_argument("--camera-shard", action="store_true",
+                        help="Publish the cameras from a second server, on the next port")
+    parser.add_argument("--no-compression", action="store_true")
+    parser.add_argument("--jpeg-backend", choices=["auto"] + list(JPEG_BACKENDS), default="auto")
+    parser.add_argument("--jpeg-subsampling", choices=["444", "422", "420"], default="420")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Seconds before measuring")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds measured")
+    parser.add_argument("--trace-allocations", type=float, default=0.0,
+                        help="Seconds of steps traced with tracemalloc after the measurement, "
+                             "failing if the steps allocate more than their payloads (0 = disabled)")
+    args = parser.parse_args()
+
+    logging.getLogger("FoxgloveServer").setLevel(logging.WARNING)
+    if not asyncio.run(run_load_test(args)):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
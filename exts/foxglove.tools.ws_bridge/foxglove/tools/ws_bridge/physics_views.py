@@ -0,0 +1,98 @@
+# Batched reads of physics state through omni.physics.tensors: the prims of all the subscribed sensors of a type
+# are gathered in a single view, read in one call per step, and each sensor picks its row.
+
+class PhysicsViewReader():
+    """Physics state of the prims of the subscribed sensors of one type, shared by them and read once per step"""
+
+    def __init__(self):
+        self._targets = dict() # Maps sensor paths to the paths of the prims read for them
+
+        self._rows = dict() # Maps prim paths to their row in the values
+        self._values = None # Output of read_view() for the current step
+        self._read_time = None
+
+        self._simulation_view = None
+        self._view = None
+        self._dirty = False # Sensors were added or removed since the view was built
+        self._failed = False
+
+
+    def add(self, prim):
+        """Adds the sensor at prim to the batched read"""
+        self.add_target(str(prim.GetPath()), str(prim.GetPath()))
+
+    def add_target(self, path : str, prim_path : str):
+        self._targets[path] = prim_path
+        self._dirty = True
+
+    def remove(self, path : str):
+        if self._targets.pop(path, None) is not None:
+            self._dirty = True
+
+    def get_target(self, path : str):
+        return self._targets.get(path)
+
+
+    def get_row(self, path : str, now : float = None):
+        """Row of a sensor in the values, None if they cannot be read. The first call of a step reads all prims"""
+        if now is None or now != self._read_time:
+            self._read_time = now
+            self._read()
+
+        if self._values is None or path not in self._targets:
+            return
+        return self._rows[self._targets[path]]
+
+
+    def create_view(self, simulation_view, prim_paths : list):
+        """Creates the omni.physics.tensors view of prim_paths (implemented per sensor type)"""
+        raise NotImplementedError
+
+    def read_view(self, view):
+        """Reads the values of all the prims of the view (implemented per sensor type)"""
+        raise NotImplementedError
+
+
+    def _read(self):
+        self._values = None
+
+        if self._dirty or (self._simulation_view is not None and not self._simulation_view.is_valid):
+            self._build_view()
+
+        if self._view is None:
+            return
+
+        try:
+            self._values = self.read_view(self._view)
+        except Exception as e:
+            print(f"[Error] Could not read the physics view: {e}")
+            self._view = None
+            self._dirty = True
+
+    def _build_view(self):
+        import omni.physics.tensors as tensors # type: ignore
+
+        self._view = None
+        self._rows = dict()
+
+        prim_paths = sorted(set(self._targets.values()))
+        if not prim_paths:
+            self._dirty = False
+            return
+
+        try:
+            if self._simulation_view is None or not self._simulation_view.is_valid:
+                self._simulation_view = tensors.create_simulation_view("numpy")
+                self._simulation_view.set_subspace_roots("/")
+
+            self._view = self.create_view(self._simulation_view, prim_paths)
+            self._rows = {prim_path: row for row, prim_path in enumerate(prim_paths)}
+            self._dirty = False
+            self._failed = False
+
+        except Exception as e:
+            # Typically the simulation is not playing yet: retried on the next step, reported once
+            if not self._failed:
+                print(f"[Error] Could not create the physics view: {e}")
+            self._failed = True
+            self._view = None
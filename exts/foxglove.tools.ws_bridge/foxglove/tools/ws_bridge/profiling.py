@@ -0,0 +1,232 @@
+# Profiling captures of a running bridge, started and stopped from Foxglove through websocket services.
+# cProfile covers collect_data() (Kit's thread) and the server threads of every shard (send path), tracemalloc the
+# allocation sites.
+# Nothing is hooked while no capture runs: collect_data() is only wrapped for the duration of a capture.
+
+import asyncio
+import cProfile
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+
+TOP_FUNCTIONS = 30 # Functions in the report, by cumulative time
+TOP_ALLOCATION_SITES = 20 # Allocation sites in the report, by size
+
+# Service name -> (request schema, response schema), JSON encoded
+SERVICES = {"/profiling/start" : ({"type": "object",
+                                   "properties": {"duration": {"type": "number",
+                                                               "description": "Seconds, 0 = until /profiling/stop"},
+                                                  "tracemalloc": {"type": "boolean"}}},
+                                  {"type": "object",
+                                   "properties": {"started": {"type": "boolean"},
+                                                  "message": {"type": "string"}}}),
+            "/profiling/stop" : ({"type": "object"},
+                                 {"type": "object",
+                                  "description": "Report of the capture, also written to the profiles folder"})}
+
+
+def get_profiles_dir():
+    cache_root = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_root, "foxglove-isaac-sim", "profiles")
+
+
+class Profiler():
+    """Profiling capture of a FoxgloveWrapper and its data collector, controlled through services"""
+
+    def __init__(self, fox_wrap):
+        self.fox_wrap = fox_wrap
+        self.service_ids = dict() # Maps service IDs to service names
+
+        self.capturing = False
+        self.last_report = None
+
+        self._main_profile = None # collect_data(), on Kit's thread
+        self._server_profiles = [] # Everything running on the server threads, including the send path, one per shard
+        self._traced_memory = False
+        self._start_time = 0.0
+        self._steps = 0
+        self._stop_handle = None
+
+    async def advertise(self, server):
+        for name, (request_schema, response_schema) in SERVICES.items():
+            service_id = await server.add_service({"name": name,
+                                                   "type": name.strip("/").replace("/", "_"),
+                                                   "requestSchema": json.dumps(request_schema),
+                                                   "responseSchema": json.dumps(response_schema)})
+            self.service_ids[service_id] = name
+
+    async def handle_request(self, service_id, payload : bytes):
+        """Runs a service call on the server thread, returns the JSON encoded response"""
+        name = self.service_ids.get(service_id)
+        request = json.loads(bytes(payload) or b"{}")
+
+        if name == "/profiling/start":
+            response = await self.start(float(request.get("duration", 0.0)), bool(request.get("tracemalloc", False)))
+        elif name == "/profiling/stop":
+            response = await self.stop() if self.capturing else self.last_report
+            response = response or {"message": "No capture"}
+        else:
+            response = {"message": f"Unknown service {service_id}"}
+
+        return json.dumps(response).encode("utf8")
+
+
+    async def start(self, duration : float = 0.0, trace_memory : bool = False):
+        if self.capturing:
+            return {"started": False, "message": "A capture is already running"}
+
+        self.capturing = True
+        self._start_time = time.monotonic()
+        self._steps = 0
+
+        self._traced_memory = trace_memory and not tracemalloc.is_tracing()
+        if self._traced_memory:
+            tracemalloc.start()
+
+        # Up to Python 3.11, a profiler only sees the thread that enabled it: collect_data() and each shard need
+        # their own, merged in the report. Since 3.12, the profiler enabled here sees every thread, and a second one
+        # could not be enabled
+        per_thread = sys.version_info < (3, 12)
+        self._main_profile = cProfile.Profile() if per_thread else None
+        self._server_profiles = []
+        for shard in self._running_shards() if per_thread else [None]:
+            profile = cProfile.Profile()
+            await self._run_on_shard(shard, profile.enable)
+            self._server_profiles.append((shard, profile))
+        await self.fox_wrap.run_on_main_thread(self._wrap_collect_data)
+
+        if duration > 0:
+            self._stop_handle = asyncio.get_running_loop().call_later(duration, self._stop_later)
+
+        return {"started": True, "message": f"Capturing for {duration} s" if duration > 0 else "Capturing"}
+
+    async def stop(self):
+        """Ends the capture and returns its report"""
+        if not self.capturing:
+            return self.last_report
+
+        self.capturing = False
+        if self._stop_handle:
+            self._stop_handle.cancel()
+            self._stop_handle = None
+
+        for shard, profile in self._server_profiles:
+            await self._run_on_shard(shard, profile.disable)
+        await self.fox_wrap.run_on_main_thread(self._unwrap_collect_data)
+        duration = time.monotonic() - self._start_time
+
+        allocation_sites = []
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+            allocation_sites = [{"site": str(statistic.traceback), "size": statistic.size, "count": statistic.count}
+                                for statistic in snapshot.statistics("lineno")[:TOP_ALLOCATION_SITES]]
+            if self._traced_memory:
+                tracemalloc.stop()
+
+        stats = pstats.Stats(*(profile for _, profile in self._server_profiles))
+        if self._main_profile is not None:
+            stats.add(self._main_profile)
+
+        pending_tasks = dict()
+        for shard in self._running_shards():
+            pending_tasks[f"server:{shard.port}"] = await self._run_on_shard(shard, self._count_tasks)
+        pending_tasks["main"] = await self.fox_wrap.run_on_main_thread(self._count_main_tasks)
+
+        self.last_report = {"duration": duration,
+                            "steps": self._steps,
+                            "top_functions": self._top_functions(stats),
+                            "allocation_sites": allocation_sites,
+                            "pending_tasks": pending_tasks}
+        self.last_report["files"] = self._save(stats, self.last_report)
+
+        return self.last_report
+
+    def cancel(self):
+        """Drops a running capture without a report, from Kit's thread (e.g. when the server closes)"""
+        if not self.capturing:
+            return
+
+        # The server threads have stopped: their profiles are dropped without being disabled from there
+        self.capturing = False
+        self._server_profiles = []
+        self._unwrap_collect_data()
+        if self._traced_memory:
+            tracemalloc.stop()
+
+    def _stop_later(self):
+        asyncio.ensure_future(self.stop())
+
+
+    def _wrap_collect_data(self):
+        # Shadows DataCollector.collect_data with an instance attribute, removed by _unwrap_collect_data()
+        data_collector = self.fox_wrap.data_collector
+        collect_data = type(data_collector).collect_data
+
+        def profiled_collect_data():
+            self._steps += 1
+            if self._main_profile is None:
+                return collect_data(data_collector)
+
+            self._main_profile.enable()
+            try:
+                collect_data(data_collector)
+            finally:
+                self._main_profile.disable()
+
+        data_collector.collect_data = profiled_collect_data
+
+    def _unwrap_collect_data(self):
+        self.fox_wrap.data_collector.__dict__.pop("collect_data", None)
+
+    def _count_main_tasks(self):
+        return len(asyncio.all_tasks(self.fox_wrap.main_loop))
+
+    def _count_tasks(self):
+        return len(asyncio.all_tasks())
+
+
+    def _running_shards(self):
+        return [shard for shard in self.fox_wrap.shards if shard.server is not None]
+
+    async def _run_on_shard(self, shard, function):
+        """Calls function on the thread of a shard (None = the current one) and returns its result"""
+        if shard is None or shard.loop is asyncio.get_running_loop():
+            return function()
+
+        async def call():
+            return function()
+
+        return await asyncio.wrap_future(shard.run_on_server_thread(call()))
+
+
+    def _top_functions(self, stats : pstats.Stats):
+        functions = []
+        for (file_name, line, function), (_, calls, total_time, cumulative_time, _) in stats.stats.items():
+            functions.append({"function": f"{function} ({os.path.basename(file_name)}:{line})",
+                              "calls": calls,
+                              "total_time": total_time,
+                              "cumulative_time": cumulative_time})
+
+        functions.sort(key=lambda function: function["cumulative_time"], reverse=True)
+        return functions[:TOP_FUNCTIONS]
+
+    def _save(self, stats : pstats.Stats, report : dict):
+        """Writes the pstats dump (e.g. for snakeviz) and the report, returns their paths"""
+        try:
+            profiles_dir = get_profiles_dir()
+            os.makedirs(profiles_dir, exist_ok=True)
+            base_name = os.path.join(profiles_dir, time.strftime("bridge-%Y%m%d-%H%M%S"))
+
+            stats.dump_stats(base_name + ".prof")
+            with open(base_name + ".json", 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+
+            return [base_name + ".prof", base_name + ".json"]
+
+        except OSError as e:
+            print(f"[Warning] Could not save the profiling report: {e}")
+            return []
@@ -0,0 +1,208 @@
+# Replays an MCAP recording through the regular FoxgloveWrapper, without Isaac Sim, to compare bridge versions
+# under the same load. Run from the extension folder (exts/foxglove.tools.ws_bridge):
+#
+#   python -m foxglove.tools.ws_bridge.replay recording.mcap --speed 2
+#
+# The file is memory-mapped and read chunk by chunk through its chunk index, so that multi-GB recordings start
+# right away and are never loaded into memory as a whole. Requires the mcap package (pip install mcap).
+
+import argparse
+import asyncio
+import logging
+import mmap
+import time
+from base64 import b64encode
+
+from .config import BridgeConfig
+from .foxglove_wrapper import FoxgloveWrapper
+from .schemas import type2schema
+from .server import CompressionPolicy, SendPriorities
+
+
+MAX_BATCH = 256 # Messages queued before they are handed over to the server thread, when replaying late or at max speed
+MAX_BACKLOG = 1024 # Messages waiting for the server thread before the replay pauses
+
+# Sensor type of the recorded schemas, for the compression policies and priorities (the first type of a schema wins)
+SCHEMA_TYPES = {schema["name"] : sensor_type for sensor_type, schema in reversed(type2schema.items())}
+
+
+def parse_speed(value : str):
+    """Replay speed: a factor of the recorded rate, or "max" (0) to send as fast as the server drains them"""
+    return 0.0 if value == "max" else float(value)
+
+
+class ReplayChannel():
+    """Stand-in for IsaacSensor, advertising a recorded channel with its topic and schema"""
+
+    def __init__(self, channel, schema):
+        self.path = channel.topic
+        self.topic = channel.topic
+        self.type = SCHEMA_TYPES.get(schema.name, "replay") if schema else "replay"
+
+        self.enabled = False
+        self.publish = True
+        self.published = 0
+
+        self.encoding = channel.message_encoding
+        self.schema_name = schema.name if schema else ""
+        self.schema_encoding = schema.encoding if schema else ""
+
+        # Protobuf schemas are advertised as base64 encoded FileDescriptorSets, the others as text
+        if schema is None:
+            self.schema = ""
+        elif schema.encoding == "protobuf":
+            self.schema = b64encode(schema.data).decode("ascii")
+        else:
+            self.schema = schema.data.decode("utf8")
+
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+
+    def get_parameters(self):
+        return {"publish": self.publish}
+
+    def set_parameter(self, name : str, value):
+        if name == "publish":
+            self.publish = bool(value)
+        else:
+            print(f"[Error] Invalid parameter \"{name}\" for {self.path}")
+
+
+
+class ReplayCollector():
+    """Stand-in for DataCollector, publishing the messages of an MCAP file through a FoxgloveWrapper"""
+
+    def __init__(self, config : BridgeConfig, path : str):
+        from mcap.reader import SeekingReader
+
+        self.config = config
+        self.path = path
+
+        self.sensors = dict() # Maps topics to ReplayChannels
+        self.channels = dict() # Maps the MCAP channel IDs to ReplayChannels
+
+        compression = CompressionPolicy(config.compression, config.compression_policies, config.compression_threshold,
+                                        config.compression_paths)
+        # Every recorded message is sent, without keeping only the latest ones of any type, to replay the same load
+        priorities = SendPriorities(config.priorities, config.send_budget)
+        self.fox_wrap = FoxgloveWrapper(self, history_duration=config.history_duration, compression=compression,
+                                        priorities=priorities)
+
+        # Pages are only read from disk when the reader seeks to their chunk
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.reader = SeekingReader(self._mmap)
+
+        summary = self.reader.get_summary()
+        if summary is None or not summary.chunk_indexes:
+            self.close()
+            raise ValueError(f"{path} has no chunk index, it can be rebuilt with `mcap recover`")
+
+        for channel in summary.channels.values():
+            schema = summary.schemas.get(channel.schema_id)
+            if channel.topic not in self.sensors:
+                self.sensors[channel.topic] = ReplayChannel(channel, schema)
+            self.channels[channel.id] = self.sensors[channel.topic]
+
+        statistics = summary.statistics
+        self.duration = (statistics.message_end_time - statistics.message_start_time) / 1e9 if statistics else 0.0
+
+
+    async def play(self, speed : float = 1.0):
+        """Sends every recorded message to the subscribed clients, at speed times the recorded rate (0 = max)"""
+        fox_wrap = self.fox_wrap
+        start_time = None
+        start = time.monotonic()
+        queued = 0
+
+        for _, _, message in self.reader.iter_messages(log_time_order=True):
+            delay = 0.0
+            if speed > 0:
+                if start_time is None:
+                    start_time = message.log_time
+                delay = start + (message.log_time - start_time) / 1e9 / speed - time.monotonic()
+
+            # Messages due at the same time are handed over together, like the payloads of a physics step
+            if delay > 0 or queued >= MAX_BATCH:
+                fox_wrap.flush()
+                queued = 0
+                while fox_wrap.get_backlog() > MAX_BACKLOG:
+                    await asyncio.sleep(0.001)
+                await asyncio.sleep(max(delay, 0))
+
+            sensor = self.channels[message.channel_id]
+            if sensor.enabled and sensor.publish:
+                fox_wrap.outbox.append((sensor.path, message.data)) # The outbox is swapped on each flush
+                sensor.published += 1
+                queued += 1
+
+        fox_wrap.flush()
+        return time.monotonic() - start
+
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def cleanup(self):
+        self.fox_wrap.close()
+        self.close()
+
+
+
+def print_report(collector : ReplayCollector, duration : float):
+    print(f"\nReplayed {collector.duration:.1f} s of recording in {duration:.1f} s\n")
+    print(f"{'topic':<40}{'msgs':>10}{'msgs/s':>10}")
+
+    for topic, sensor in sorted(collector.sensors.items()):
+        print(f"{topic:<40}{sensor.published:>10}{sensor.published / duration if duration > 0 else 0.0:>10.1f}")
+
+
+async def run_replay(args):
+    config = BridgeConfig(port=args.port, compression=not args.no_compression)
+    collector = ReplayCollector(config, args.file)
+    collector.fox_wrap.start(config.port, collector.sensors)
+
+    try:
+        # Messages are only sent to subscribed channels: let the clients connect first
+        if args.wait_for_subscriber:
+            while not any(sensor.enabled for sensor in collector.sensors.values()):
+                await asyncio.sleep(0.1)
+
+        duration = 0.0
+        for _ in range(args.repeat):
+            duration += await collector.play(args.speed)
+        await asyncio.sleep(0.2) # Messages of the last batch are still being sent
+
+    finally:
+        collector.cleanup()
+
+    print_report(collector, duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay of an MCAP recording through the Foxglove bridge")
+    parser.add_argument("file", help="MCAP file, with a chunk index")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--speed", type=parse_speed, default=1.0, help="Factor of the recorded rate, or max")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of times the recording is played")
+    parser.add_argument("--wait-for-subscriber", action="store_true",
+                        help="Start once a client subscribed to a channel")
+    parser.add_argument("--no-compression", action="store_true")
+    args = parser.parse_args()
+
+    logging.getLogger("FoxgloveServer").setLevel(logging.WARNING)
+    try:
+        asyncio.run(run_replay(args))
+    except (ImportError, ValueError, OSError) as e:
+        print(f"[Error] Could not replay {args.file}: {e}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# Rigid bodies outside of articulations (props, free-floating objects): their world pose and velocities are read
+# through a single omni.physics.tensors rigid body view, in one call per step for all the subscribed bodies.
+
+from google.protobuf.descriptor_pb2 import FieldDescriptorProto
+
+from foxglove_schemas_protobuf.Pose_pb2 import Pose
+from foxglove_schemas_protobuf.Vector3_pb2 import Vector3
+
+from .physics_views import PhysicsViewReader
+from .schemas import build_message_class
+
+
+# Field numbers of timestamp, frame_id and pose follow foxglove.PoseInFrame (timestamp is left out)
+RigidBodyState = build_message_class("foxglove_isaac_sim/RigidBodyState.proto", "foxglove_isaac_sim.RigidBodyState",
+    [("frame_id", 2, FieldDescriptorProto.TYPE_STRING, None),
+     ("pose", 3, FieldDescriptorProto.TYPE_MESSAGE, ".foxglove.Pose"),
+     ("linear_velocity", 4, FieldDescriptorProto.TYPE_MESSAGE, ".foxglove.Vector3"), # m/s, axes of frame_id
+     ("angular_velocity", 5, FieldDescriptorProto.TYPE_MESSAGE, ".foxglove.Vector3")], # rad/s, axes of frame_id
+    dependencies=[Pose.DESCRIPTOR.file.name, Vector3.DESCRIPTOR.file.name])
+
+
+class RigidBodyReader(PhysicsViewReader):
+    """Poses and velocities of the subscribed rigid bodies in the frame of the TF root, shared by them and read once
+    per step"""
+
+    def __init__(self):
+        super().__init__()
+        self.root_prim = None # Root of the transform tree, None or the pseudo-root for the world
+        self.frame_id = "" # Name of the root frame in /tf
+
+    def set_root(self, root_prim):
+        self.root_prim = root_prim
+        self.frame_id = root_prim.GetName()
+
+    def get_state(self, path : str, now : float = None):
+        """(7,) position and xyzw orientation and (6,) linear and angular velocities of a body, None if they
+        cannot be read. The first call of a step reads all bodies"""
+        row = self.get_row(path, now)
+        if row is None:
+            return
+        transforms, velocities = self._values
+        return transforms[row], velocities[row]
+
+
+    def create_view(self, simulation_view, prim_paths : list):
+        return simulation_view.create_rigid_body_view(prim_paths)
+
+    def read_view(self, view):
+        transforms, velocities = view.get_transforms(), view.get_velocities()
+
+        pose = root_pose(self.root_prim)
+        if pose is None:
+            return transforms, velocities
+        return to_root_frame(transforms, velocities, *pose)
+
+
+def find_articulation_links(stage):
+    """Paths of the rigid bodies belonging to an articulation, which publishes them through its joint states and
+    /tf: the bodies under an articulation root, and those reached from them through joints (ArticulationRootAPI
+    is often applied to the root link itself, whose sibling links are only connected to it by joints)"""
+    from pxr import Usd, UsdPhysics # type: ignore
+
+    roots = []
+    bodies = set()
+    joints = dict() # Maps body paths to the bodies they are jointed to
+
+    for prim in stage.Traverse():
+        if prim.HasAPI(UsdPhysics.ArticulationRootAPI):
+            roots.append(prim)
+        if prim.HasAPI(UsdPhysics.RigidBodyAPI):
+            bodies.add(prim.GetPath())
+
+        if prim.IsA(UsdPhysics.Joint):
+            joint = UsdPhysics.Joint(prim)
+            if joint.GetExcludeFromArticulationAttr().Get():
+                continue
+            targets = joint.GetBody0Rel().GetTargets() + joint.GetBody1Rel().GetTargets()
+            for body in targets:
+                joints.setdefault(body, set()).update(target for target in targets if target != body)
+
+    # Bodies under the articulation roots (a root can also be an ancestor of the links, or a fixed joint)
+    pending = []
+    for root in roots:
+        pending.extend(prim.GetPath() for prim in Usd.PrimRange(root))
+        if root.IsA(UsdPhysics.Joint):
+            joint = UsdPhysics.Joint(root)
+            pending.extend(joint.GetBody0Rel().GetTargets() + joint.GetBody1Rel().GetTargets())
+    links = set()
+
+    while pending:
+        path = pending.pop()
+        if path in links:
+            continue
+        links.add(path)
+        pending.extend(joints.get(path, ()))
+
+    return {str(path) for path in links & bodies}
+
+
+def root_pose(root_prim):
+    """(3,) world position and xyzw orientation of the TF root, None when it is the world itself"""
+    from pxr import Usd, UsdGeom # type: ignore
+
+    if root_prim is None or not root_prim.IsValid() or root_prim.IsPseudoRoot() \
+            or not root_prim.IsA(UsdGeom.Xformable):
+        return
+
+    matrix = UsdGeom.Xformable(root_prim).ComputeLocalToWorldTransform(Usd.TimeCode.Default())
+    rotation = matrix.ExtractRotationQuat()
+    return tuple(matrix.ExtractTranslation()), (*rotation.GetImaginary(), rotation.GetReal())
+
+
+def to_root_frame(transforms, velocities, position, orientation):
+    """Expresses the (n, 7) world poses and (n, 6) world velocities read from the rigid body view in the frame of
+    the TF root, given its world position and xyzw orientation"""
+    import numpy as np
+
+    x, y, z, w = orientation
+    rotation = np.array([[1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+                         [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+                         [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)]])
+
+    transforms = np.array(transforms, dtype=np.float64)
+    velocities = np.array(velocities, dtype=np.float64)
+
+    # Inverse rotation of row vectors: v @ R is R.T @ v for every row
+    transforms[:, :3] = (transforms[:, :3] - position) @ rotation
+    velocities[:, :3] = velocities[:, :3] @ rotation
+    velocities[:, 3:] = velocities[:, 3:] @ rotation
+
+    # Orientations: conjugate of the root orientation times the body orientation
+    ax, ay, az, aw = -x, -y, -z, w
+    bx, by, bz, bw = transforms[:, 3].copy(), transforms[:, 4].copy(), transforms[:, 5].copy(), transforms[:, 6].copy()
+    transforms[:, 3] = aw * bx + ax * bw + ay * bz - az * by
+    transforms[:, 4] = aw * by - ax * bz + ay * bw + az * bx
+    transforms[:, 5] = aw * bz + ax * by - ay * bx + az * bw
+    transforms[:, 6] = aw * bw - ax * bx - ay * by - az * bz
+    return transforms, velocities
+
+
+def fill_rigid_body(message, transform, velocity, frame_id : str):
+    """Writes a transform and velocities from the rigid body view into an existing RigidBodyState"""
+    x, y, z, qx, qy, qz, qw = (float(value) for value in transform)
+    vx, vy, vz, wx, wy, wz = (float(value) for value in velocity)
+
+    message.frame_id = frame_id
+    message.pose.position.x = x
+    message.pose.position.y = y
+    message.pose.position.z = z
+    message.pose.orientation.x = qx
+    message.pose.orientation.y = qy
+    message.pose.orientation.z = qz
+    message.pose.orientation.w = qw
+    message.linear_velocity.x = vx
+    message.linear_velocity.y = vy
+    message.linear_velocity.z = vz
+    message.angular_velocity.x = wx
+    message.angular_velocity.y = wy
+    message.angular_velocity.z = wz
@@ -0,0 +1,314 @@
+# Geometry of the prims under the TF root, published as foxglove.SceneUpdate messages.
+# Entities are attached to the TF frame of their prim, or of its nearest ancestor published on /tf (frame_locked), so
+# once a client has the geometry, only the poses streamed on /tf change. /tf only carries translations and rotations:
+# the scales between the prim and its frame are baked into the vertices or the primitive sizes.
+# The geometry itself is only converted and sent again when its content changes: updates hold the entities added or
+# changed since the previous one, and deletions of the removed ones by ID.
+
+import hashlib
+import math
+
+import numpy as np
+from pxr import Gf, Usd, UsdGeom # type: ignore
+
+from foxglove_schemas_protobuf.SceneEntity_pb2 import SceneEntity
+from foxglove_schemas_protobuf.SceneEntityDeletion_pb2 import SceneEntityDeletion
+from foxglove_schemas_protobuf.SceneUpdate_pb2 import SceneUpdate
+from foxglove_schemas_protobuf.TriangleListPrimitive_pb2 import TriangleListPrimitive
+
+
+MAX_MESH_VERTICES = 200000 # Larger meshes are skipped, they would take too long to convert and send
+DEFAULT_COLOR = (0.7, 0.7, 0.7)
+
+# Rotation (x, y, z, w) aligning the Z axis of Foxglove primitives with the axis of USD primitives
+AXIS_ROTATIONS = {"X" : (0.0, math.sqrt(0.5), 0.0, math.sqrt(0.5)),
+                  "Y" : (-math.sqrt(0.5), 0.0, 0.0, math.sqrt(0.5)),
+                  "Z" : (0.0, 0.0, 0.0, 1.0)}
+# Axes of the USD prim along the X, Y and Z axes of the Foxglove primitive, once rotated
+AXIS_SCALES = {"X" : (2, 1, 0),
+               "Y" : (0, 2, 1),
+               "Z" : (0, 1, 2)}
+
+SCENE_UPDATE_ENTITIES_TAG = b"\x12" # Field 2 (entities) of SceneUpdate, length-delimited
+SCENE_ENTITY_TRIANGLES_TAG = b"\x62" # Field 12 (triangles) of SceneEntity, length-delimited
+TRIANGLES_INDICES_TAG = b"\x2a" # Field 5 (indices) of TriangleListPrimitive, packed fixed32
+
+# Serialized TriangleListPrimitive.points entry: field 2 tag and length, then the x, y and z doubles of the Point3
+POINT_ENTRY = np.dtype([("tag", "u1"), ("length", "u1"),
+                        ("x_tag", "u1"), ("x", "<f8"), ("y_tag", "u1"), ("y", "<f8"), ("z_tag", "u1"), ("z", "<f8")])
+
+
+def triangulate(face_vertex_counts : np.ndarray, face_vertex_indices : np.ndarray):
+    """Fan triangulation of polygon faces, returns a flat array of triangle vertex indices"""
+    counts = face_vertex_counts[face_vertex_counts >= 3]
+    starts = (np.cumsum(face_vertex_counts) - face_vertex_counts)[face_vertex_counts >= 3]
+
+    triangles_per_face = counts - 2
+    face_starts = np.repeat(starts, triangles_per_face)
+    corners = np.arange(triangles_per_face.sum()) - np.repeat(np.cumsum(triangles_per_face) - triangles_per_face,
+                                                             triangles_per_face)
+
+    return np.stack([face_vertex_indices[face_starts],
+                     face_vertex_indices[face_starts + corners + 1],
+                     face_vertex_indices[face_starts + corners + 2]], axis=-1).ravel()
+
+
+def get_local_matrix(prim):
+    """(4, 4) local transform of a prim, row vectors as in USD, identity for prims without transform"""
+    if not prim.IsA(UsdGeom.Xformable):
+        return np.identity(4)
+    return np.array(UsdGeom.Xformable(prim).GetLocalTransformation())
+
+
+def get_scale_matrix(local_matrix : np.ndarray):
+    """Part of a local transform left out of its TF frame, which only keeps the translation and rotation"""
+    rigid_matrix = np.array(Gf.Matrix4d(local_matrix.tolist()).RemoveScaleShear())
+    return local_matrix @ np.linalg.inv(rigid_matrix)
+
+
+def decompose(matrix : np.ndarray):
+    """Translation, xyzw rotation and per-axis scale of a (4, 4) transform (shear is ignored)"""
+    scale = np.linalg.norm(matrix[:3, :3], axis=1)
+    rotation = Gf.Matrix4d(matrix.tolist()).RemoveScaleShear().ExtractRotationQuat()
+    return matrix[3, :3], (*rotation.GetImaginary(), rotation.GetReal()), scale
+
+
+def multiply_quaternions(q1, q2):
+    """Rotation q2 followed by q1, xyzw"""
+    x1, y1, z1, w1 = q1
+    x2, y2, z2, w2 = q2
+    return (w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+            w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+            w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2,
+            w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2)
+
+
+def encode_points(points : np.ndarray):
+    """Serialized repeated TriangleListPrimitive.points of an (N, 3) array, built without a Point3 per vertex"""
+    entries = np.empty(len(points), dtype=POINT_ENTRY)
+    entries["tag"], entries["length"] = 0x12, POINT_ENTRY.itemsize - 2
+    entries["x_tag"], entries["y_tag"], entries["z_tag"] = 0x09, 0x11, 0x19
+    entries["x"], entries["y"], entries["z"] = points[:, 0], points[:, 1], points[:, 2]
+    return entries.tobytes()
+
+
+def encode_indices(indices : np.ndarray):
+    """Serialized packed TriangleListPrimitive.indices"""
+    packed = indices.astype("<u4").tobytes()
+    return TRIANGLES_INDICES_TAG + encode_varint(len(packed)) + packed
+
+
+def encode_varint(value : int):
+    encoded = bytearray()
+    while value > 0x7F:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+class SceneCache():
+    """Converted geometry of every prim under the root, keyed by the hash of its USD attributes"""
+
+    def __init__(self):
+        self.entities = dict() # Maps prim paths to (content hash, serialized SceneEntity)
+        self._converted = dict() # Maps content hashes to serialized SceneEntity, so unchanged prims are not converted again
+
+        # Changes of the last update
+        self.changed = [] # Paths of the entities added or changed
+        self.removed = [] # Paths of the entities removed
+
+    def update(self, stage, root_path : str, is_frame = None):
+        """Reads the geometry under root_path, returns whether it changed since the last update.
+        is_frame(prim, depth) tells whether /tf publishes a frame for a prim whose parent has one (default: all)"""
+        entities = dict()
+        converted = dict()
+        frames = dict() # Maps prim paths to (frame name, depth, whether the prim is the frame, prim to frame transform)
+
+        root = stage.GetPrimAtPath(root_path)
+        for prim in Usd.PrimRange(root):
+            frame = self._get_frame(prim, root, frames, is_frame)
+            frames[prim.GetPath()] = frame
+
+            if not prim.IsA(UsdGeom.Gprim) or not self._is_visible(prim):
+                continue
+
+            attributes = self._read_attributes(prim)
+            if attributes is None:
+                continue
+            attributes["frame_id"] = frame[0]
+            # Rounded so that the float noise of moving frames does not look like a change of the geometry
+            attributes["transform"] = np.round(frame[3], 9)
+
+            content_hash = self._hash(prim, attributes)
+            entity = self._converted.get(content_hash)
+            if entity is None:
+                entity = self._convert(prim, attributes)
+            if entity is None:
+                continue
+
+            entities[str(prim.GetPath())] = (content_hash, entity)
+            converted[content_hash] = entity
+
+        self.changed = [path for path, (content_hash, _) in entities.items()
+                        if path not in self.entities or self.entities[path][0] != content_hash]
+        self.removed = [path for path in self.entities if path not in entities]
+
+        self.entities = entities
+        self._converted = converted
+        return bool(self.changed or self.removed)
+
+    def serialize_changes(self):
+        """SceneUpdate of the last update: the entities added or changed, and deletions of the removed ones"""
+        scene_update = SceneUpdate()
+        for path in self.removed:
+            deletion = scene_update.deletions.add()
+            deletion.type = SceneEntityDeletion.Type.MATCHING_ID
+            deletion.id = path # Entities are identified by the path of their prim
+
+        return self._serialize(scene_update, self.changed)
+
+    def serialize(self):
+        """SceneUpdate replacing all the entities of the scene with the cached ones, for new subscribers"""
+        scene_update = SceneUpdate()
+        scene_update.deletions.add().type = SceneEntityDeletion.Type.ALL
+        return self._serialize(scene_update, self.entities)
+
+    def _serialize(self, scene_update, paths):
+        payload = [scene_update.SerializeToString()]
+
+        # Entities are already serialized: append them as repeated fields instead of parsing them again
+        for path in paths:
+            entity = self.entities[path][1]
+            payload += [SCENE_UPDATE_ENTITIES_TAG, encode_varint(len(entity)), entity]
+
+        return b"".join(payload)
+
+
+    def _get_frame(self, prim, root, frames : dict, is_frame):
+        """TF frame of a prim: its own, or the one of its nearest ancestor with a frame, and the transform from the
+        prim to that frame (its local transforms and the scale of the frame, which /tf leaves out)"""
+        local_matrix = get_local_matrix(prim)
+        if prim == root:
+            return prim.GetName(), 0, True, get_scale_matrix(local_matrix)
+
+        parent_name, parent_depth, parent_is_frame, parent_matrix = frames[prim.GetParent().GetPath()]
+        if parent_is_frame and (is_frame is None or is_frame(prim, parent_depth + 1)):
+            return prim.GetName(), parent_depth + 1, True, get_scale_matrix(local_matrix)
+        return parent_name, parent_depth, False, local_matrix @ parent_matrix
+
+    def _is_visible(self, prim):
+        imageable = UsdGeom.Imageable(prim)
+        return imageable.ComputeVisibility() != UsdGeom.Tokens.invisible \
+                and imageable.ComputePurpose() != UsdGeom.Tokens.guide
+
+    def _read_attributes(self, prim):
+        """Returns the attributes defining the geometry of the prim, None if it is not supported"""
+        color = UsdGeom.Gprim(prim).GetDisplayColorAttr().Get()
+        attributes = {"color": tuple(color[0]) if color else DEFAULT_COLOR}
+
+        if prim.IsA(UsdGeom.Mesh):
+            mesh = UsdGeom.Mesh(prim)
+            points = mesh.GetPointsAttr().Get()
+            if not points or len(points) > MAX_MESH_VERTICES:
+                return
+            attributes["points"] = np.asarray(points, dtype=np.float32)
+            attributes["counts"] = np.asarray(mesh.GetFaceVertexCountsAttr().Get(), dtype=np.int64)
+            attributes["indices"] = np.asarray(mesh.GetFaceVertexIndicesAttr().Get(), dtype=np.int64)
+
+        elif prim.IsA(UsdGeom.Cube):
+            attributes["size"] = UsdGeom.Cube(prim).GetSizeAttr().Get()
+
+        elif prim.IsA(UsdGeom.Sphere):
+            attributes["radius"] = UsdGeom.Sphere(prim).GetRadiusAttr().Get()
+
+        elif prim.IsA(UsdGeom.Cylinder) or prim.IsA(UsdGeom.Cone) or prim.IsA(UsdGeom.Capsule):
+            shape = UsdGeom.Cylinder(prim) if prim.IsA(UsdGeom.Cylinder) \
+                    else UsdGeom.Cone(prim) if prim.IsA(UsdGeom.Cone) else UsdGeom.Capsule(prim)
+            attributes["radius"] = shape.GetRadiusAttr().Get()
+            attributes["height"] = shape.GetHeightAttr().Get()
+            attributes["axis"] = shape.GetAxisAttr().Get()
+
+        else:
+            return
+
+        return attributes
+
+    def _hash(self, prim, attributes : dict):
+        content_hash = hashlib.blake2b(digest_size=16)
+        content_hash.update(prim.GetTypeName().encode())
+        content_hash.update(str(prim.GetPath()).encode()) # The entity ID
+        for key, value in sorted(attributes.items()):
+            content_hash.update(key.encode())
+            content_hash.update(value.tobytes() if isinstance(value, np.ndarray) else repr(value).encode())
+        return content_hash.digest()
+
+    def _convert(self, prim, attributes : dict):
+        """Serialized SceneEntity of the prim, expressed in its TF frame"""
+        entity = SceneEntity()
+        entity.frame_id = attributes["frame_id"] # Same frame IDs as the transform tree
+        entity.id = str(prim.GetPath())
+        entity.frame_locked = True
+
+        color = attributes["color"]
+        prim_type = prim.GetTypeName()
+        transform = attributes["transform"]
+        position, orientation, scale = decompose(transform)
+
+        if prim_type == "Mesh":
+            # The vertex and index buffers are appended to the serialized primitive (see below)
+            primitive = TriangleListPrimitive()
+
+        elif prim_type == "Cube":
+            primitive = entity.cubes.add()
+            primitive.size.x, primitive.size.y, primitive.size.z = attributes["size"] * scale
+
+        elif prim_type == "Sphere":
+            primitive = entity.spheres.add()
+            primitive.size.x, primitive.size.y, primitive.size.z = 2 * attributes["radius"] * scale
+
+        else:
+            radius, height, axis = attributes["radius"], attributes["height"], attributes["axis"]
+
+            # Scale along the X, Y and Z axes of the Foxglove cylinder, whose Z axis is the axis of the prim
+            scale_x, scale_y, scale_z = scale[list(AXIS_SCALES.get(axis, AXIS_SCALES["Z"]))]
+
+            primitive = entity.cylinders.add()
+            primitive.size.x = 2 * radius * scale_x
+            primitive.size.y = 2 * radius * scale_y
+            primitive.size.z = height * scale_z
+            primitive.bottom_scale = 1.0
+            primitive.top_scale = 0.0 if prim_type == "Cone" else 1.0
+            axis_rotation = AXIS_ROTATIONS.get(axis, AXIS_ROTATIONS["Z"])
+            self._set_pose(primitive.pose, position, multiply_quaternions(orientation, axis_rotation))
+
+            # Capsules are a cylinder between two spheres
+            if prim_type == "Capsule":
+                for side in [-1, 1]:
+                    center = np.zeros(3)
+                    center["XYZ".index(axis) if axis in AXIS_ROTATIONS else 2] = side * height / 2
+
+                    sphere = entity.spheres.add()
+                    sphere.size.x, sphere.size.y, sphere.size.z = 2 * radius * scale
+                    self._set_pose(sphere.pose, center @ transform[:3, :3] + transform[3, :3], orientation)
+                    sphere.color.r, sphere.color.g, sphere.color.b, sphere.color.a = (*color, 1.0)
+
+        if prim_type in ["Cube", "Sphere"]:
+            self._set_pose(primitive.pose, position, orientation)
+        elif prim_type == "Mesh":
+            primitive.pose.orientation.w = 1.0
+        primitive.color.r, primitive.color.g, primitive.color.b, primitive.color.a = (*color, 1.0)
+
+        if prim_type == "Mesh":
+            # Vertices are expressed in the frame, with the scales /tf leaves out
+            points = attributes["points"] @ transform[:3, :3] + transform[3, :3]
+            triangles = b"".join([primitive.SerializeToString(), encode_points(points),
+                                  encode_indices(triangulate(attributes["counts"], attributes["indices"]))])
+            return b"".join([entity.SerializeToString(), SCENE_ENTITY_TRIANGLES_TAG, encode_varint(len(triangles)),
+                             triangles])
+
+        return entity.SerializeToString()
+
+    def _set_pose(self, pose, position, orientation):
+        pose.position.x, pose.position.y, pose.position.z = (float(value) for value in position)
+        pose.orientation.x, pose.orientation.y, pose.orientation.z, pose.orientation.w = orientation
@@ -4,15 +4,11 @@
 
 import os
 import json
+import importlib
 from base64 import b64encode
 from typing import Set, Type
 
-from foxglove_schemas_protobuf.CompressedImage_pb2 import CompressedImage
-from foxglove_schemas_protobuf.FrameTransforms_pb2 import FrameTransforms
-
-import google.protobuf.message
-from google.protobuf.descriptor_pb2 import FileDescriptorSet
-from google.protobuf.descriptor import FileDescriptor
+# The protobuf modules are only imported when a descriptor is missing from the cache (see load_schema_for_type)
 
 
 type2schema = {
@@ -22,8 +18,8 @@ type2schema = {
                     "encoding" : "json",
                 },
                 "camera": {
-                    "file": CompressedImage,
-                    "name": CompressedImage.DESCRIPTOR.full_name,
+                    "file": "foxglove_schemas_protobuf.CompressedImage_pb2.CompressedImage",
+                    "name": "foxglove.CompressedImage",
                     "encoding" : "protobuf",
                 },
                 "imu" : {
@@ -31,14 +27,44 @@ type2schema = {
                     "name": "IMU",
                     "encoding" : "json",
                 },
+                "imu_batch" : {
+                    "file": "ImuBatch.json",
+                    "name": "IMUBatch",
+                    "encoding" : "json",
+                },
                 "articulation" : {
                     "file": "JointStates.json",
                     "name": "JointStates",
                     "encoding" : "json",
                 },
+                "raw_image" : {
+                    "file": "foxglove_schemas_protobuf.RawImage_pb2.RawImage",
+                    "name": "foxglove.RawImage",
+                    "encoding" : "protobuf",
+                },
+                "segmentation_labels" : {
+                    "file": "SegmentationLabels.json",
+                    "name": "SegmentationLabels",
+                    "encoding" : "json",
+                },
                 "tf_tree" : {
-                    "file": FrameTransforms,
-                    "name": FrameTransforms.DESCRIPTOR.full_name,
+                    "file": "foxglove_schemas_protobuf.FrameTransforms_pb2.FrameTransforms",
+                    "name": "foxglove.FrameTransforms",
+                    "encoding" : "protobuf",
+                },
+                "scene" : {
+                    "file": "foxglove_schemas_protobuf.SceneUpdate_pb2.SceneUpdate",
+                    "name": "foxglove.SceneUpdate",
+                    "encoding" : "protobuf",
+                },
+                "contact" : {
+                    "file": "foxglove.tools.ws_bridge.contact.ContactForce",
+                    "name": "foxglove_isaac_sim.ContactForce",
+                    "encoding" : "protobuf",
+                },
+                "rigid_body" : {
+                    "file": "foxglove.tools.ws_bridge.rigid_bodies.RigidBodyState",
+                    "name": "foxglove_isaac_sim.RigidBodyState",
                     "encoding" : "protobuf",
                 }
               }
@@ -46,13 +72,18 @@ type2schema = {
 encoding2schema = {"json" : "jsonschema",
                    "protobuf" : "protobuf"}
 
+_schema_cache = dict() # Maps sensor types to loaded schemas
+
 
 def build_file_descriptor_set(
-    message_class: Type[google.protobuf.message.Message],
-) -> FileDescriptorSet:
+    message_class: Type["google.protobuf.message.Message"],
+) -> "FileDescriptorSet":
     """
     Build a FileDescriptorSet representing the message class and its dependencies.
     """
+    from google.protobuf.descriptor_pb2 import FileDescriptorSet
+    from google.protobuf.descriptor import FileDescriptor
+
     file_descriptor_set = FileDescriptorSet()
     seen_dependencies: Set[str] = set()
 
@@ -67,8 +98,84 @@ def build_file_descriptor_set(
     return file_descriptor_set
 
 
+def import_message_class(class_path : str):
+    """Imports a protobuf message class from its full path, e.g. package.Module_pb2.Message"""
+    module_name, class_name = class_path.rsplit(".", 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def build_message_class(file_name : str, message_name : str, fields : list, dependencies : list = ()):
+    """Protobuf class of one of the extension's own messages, built from its descriptor (there is no generated
+    module). fields are (name, number, type, type name) tuples, the type name being None for scalar fields"""
+    from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+
+    pool = descriptor_pool.Default()
+    package, name = message_name.rsplit(".", 1)
+
+    try:
+        pool.FindFileByName(file_name)
+    except KeyError:
+        file_proto = descriptor_pb2.FileDescriptorProto(name=file_name, package=package, syntax="proto3",
+                                                        dependency=list(dependencies))
+        message = file_proto.message_type.add(name=name)
+
+        for field_name, number, field_type, type_name in fields:
+            field = message.field.add(name=field_name, number=number, type=field_type,
+                                      label=descriptor_pb2.FieldDescriptorProto.LABEL_OPTIONAL)
+            if type_name:
+                field.type_name = type_name
+
+        pool.AddSerializedFile(file_proto.SerializeToString())
+
+    descriptor = pool.FindMessageTypeByName(message_name)
+    if hasattr(message_factory, "GetMessageClass"):
+        return message_factory.GetMessageClass(descriptor)
+    return message_factory.MessageFactory(pool).GetPrototype(descriptor)
+
+
+def get_descriptor_cache_dir():
+    """Directory of the serialized descriptors, one per foxglove-schemas-protobuf version"""
+    try:
+        from importlib.metadata import version
+        schemas_version = version("foxglove-schemas-protobuf")
+    except Exception:
+        return None
+
+    cache_root = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_root, "foxglove-isaac-sim", "descriptors", schemas_version)
+
+
+def load_descriptor_set(class_path : str):
+    """Returns the base64 encoded FileDescriptorSet of a message class, using the on-disk cache when possible"""
+    # Only the foxglove schemas are cached: the extension's own ones change with the extension, not the package
+    cache_dir = get_descriptor_cache_dir() if class_path.startswith("foxglove_schemas_protobuf.") else None
+    cache_file = os.path.join(cache_dir, class_path + ".b64") if cache_dir else None
+
+    if cache_file and os.path.isfile(cache_file):
+        with open(cache_file, 'r') as descriptor_file:
+            return descriptor_file.read()
+
+    message_class = import_message_class(class_path)
+    descriptor_set = b64encode(build_file_descriptor_set(message_class).SerializeToString()).decode("ascii")
+
+    if cache_file:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w') as descriptor_file:
+                descriptor_file.write(descriptor_set)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            print(f"[Warning] Could not cache descriptor of {class_path}: {e}")
+
+    return descriptor_set
+
+
 def load_schema_for_type(sensor_type):
 
+    if sensor_type in _schema_cache:
+        return _schema_cache[sensor_type]
+
     encoding = type2schema[sensor_type]["encoding"]
     file = type2schema[sensor_type]["file"]
 
@@ -77,18 +184,37 @@ def load_schema_for_type(sensor_type):
         json_path = os.path.join(curr_dir, 'json_schemas/')
         with open(json_path + file, 'r') as schema_file:
             json_schema = json.load(schema_file)
-        return json.dumps(json_schema)
+        schema = json.dumps(json_schema)
 
     elif encoding == "protobuf":
-        return b64encode(build_file_descriptor_set(file).SerializeToString()).decode("ascii")
+        schema = load_descriptor_set(file)
+
+    _schema_cache[sensor_type] = schema
+    return schema
+
+
+def get_schema_type(sensor):
+    """Key of the sensor's schema in type2schema"""
+    if sensor.type == "imu" and getattr(sensor, "batched", False):
+        return "imu_batch"
+    if sensor.type == "segmentation":
+        return "raw_image" if sensor.segmentation_encoding == "raw" else "camera"
+    if sensor.type == "camera_rendition":
+        return "camera"
+    return sensor.type
 
 
 def get_schema_for_sensor(sensor):
     """Returns name, schema, encoding, schemaEncoding"""
 
-    name = type2schema[sensor.type]["name"]
-    schema = load_schema_for_type(sensor.type)
-    encoding = type2schema[sensor.type]["encoding"]
+    # Replayed channels advertise the schema they were recorded with
+    if getattr(sensor, "schema", None) is not None:
+        return sensor.schema_name, sensor.schema, sensor.encoding, sensor.schema_encoding
+
+    schema_type = get_schema_type(sensor)
+    name = type2schema[schema_type]["name"]
+    schema = load_schema_for_type(schema_type)
+    encoding = type2schema[schema_type]["encoding"]
     schemaEncoding = encoding2schema[encoding]
 
     return name, schema, encoding, schemaEncoding
@@ -0,0 +1,83 @@
+# Encoding of the segmentation masks produced by the camera annotators.
+# IDs are mapped to colors through a numpy lookup table, so no Python code runs per pixel.
+
+import io
+import json
+
+import numpy as np
+from PIL import Image
+
+from foxglove_schemas_protobuf.CompressedImage_pb2 import CompressedImage
+from foxglove_schemas_protobuf.RawImage_pb2 import RawImage
+
+
+MAX_PALETTE_SIZE = 1 << 20 # IDs above this are colored from the IDs present in the frame instead
+
+_palette = np.zeros((1, 3), dtype=np.uint8)
+
+
+def id_colors(ids : np.ndarray):
+    """Stable color of each ID, ID 0 (unlabelled) being black"""
+    hashed = ids.astype(np.uint32) * np.uint32(2654435761) # Knuth's multiplicative hash spreads consecutive IDs apart
+    colors = np.stack([hashed >> 24, hashed >> 16, hashed >> 8], axis=-1).astype(np.uint8)
+    colors[ids == 0] = 0
+    return colors
+
+
+def get_palette(size : int):
+    """Lookup table of the colors of IDs 0 to size - 1, grown as needed"""
+    global _palette
+    if len(_palette) < size:
+        _palette = id_colors(np.arange(1 << (size - 1).bit_length(), dtype=np.uint32))
+    return _palette
+
+
+def colorize(ids : np.ndarray):
+    """Converts an (H, W) array of IDs into an (H, W, 3) RGB image"""
+    max_id = int(ids.max()) if ids.size else 0
+
+    if max_id < MAX_PALETTE_SIZE:
+        return get_palette(max_id + 1)[ids]
+
+    unique_ids, inverse = np.unique(ids, return_inverse=True)
+    return id_colors(unique_ids)[inverse].reshape(ids.shape + (3,))
+
+
+def encode_png(ids : np.ndarray, frame_id : str):
+    """Colorized mask as a lossless PNG CompressedImage"""
+    buffered = io.BytesIO()
+    Image.fromarray(colorize(ids)).save(buffered, format="png", compress_level=1)
+
+    compressed_image = CompressedImage()
+    compressed_image.format = "png"
+    compressed_image.data = buffered.getvalue()
+    compressed_image.frame_id = frame_id
+
+    return compressed_image.SerializeToString()
+
+
+def encode_raw(ids : np.ndarray, frame_id : str):
+    """IDs as a single channel (mono16) RawImage"""
+    height, width = ids.shape[:2]
+
+    raw_image = RawImage()
+    raw_image.frame_id = frame_id
+    raw_image.width = width
+    raw_image.height = height
+    raw_image.encoding = "mono16"
+    raw_image.step = width * 2
+    raw_image.data = np.minimum(ids, 0xFFFF).astype("<u2").tobytes()
+
+    return raw_image.SerializeToString()
+
+
+def encode_labels(id_to_labels : dict, frame_id : str):
+    """ID to label mapping, as sent on the labels channel"""
+    labels = []
+    for segmentation_id, label in sorted(id_to_labels.items(), key=lambda item: int(item[0])):
+        # Semantic labels come as {"class": "cube"}, instance labels as prim paths
+        if isinstance(label, dict):
+            label = ",".join(str(value) for value in label.values())
+        labels.append({"id": int(segmentation_id), "label": str(label)})
+
+    return json.dumps({"frame_id": frame_id, "labels": labels}).encode("utf8")
@@ -0,0 +1,173 @@
+# Sensor lists of the extension UI, built on an omni.ui TreeView: rows are only built for the visible sensors,
+# and sensors added to or removed from the stage update the model without rebuilding the other rows.
+
+from bisect import bisect_left
+
+import omni.ui as ui
+from omni.isaac.ui.ui_utils import get_style
+from omni.isaac.ui.element_wrappers import CollapsableFrame
+
+
+LIST_HEIGHT = 200 # Pixels, the list scrolls beyond that
+COLUMN_WIDTHS = [ui.Fraction(1), ui.Pixel(70), ui.Pixel(80)] # Path, rate, state
+
+
+class SensorItem(ui.AbstractItem):
+    """Row of a sensor list: path, measured publishing rate and subscription state"""
+
+    def __init__(self, sensor):
+        super().__init__()
+        self.sensor = sensor
+        self.values = [sensor.path, "-", "idle"]
+        self._last_published = sensor.published
+
+    def update(self, elapsed : float):
+        """Refreshes the rate and state, returns whether the row changed"""
+        published = self.sensor.published
+        rate = (published - self._last_published) / elapsed if elapsed > 0 else 0.0
+        self._last_published = published
+
+        if not self.sensor.enabled:
+            state = "idle"
+        elif not self.sensor.publish:
+            state = "paused"
+        else:
+            state = "subscribed"
+
+        values = [self.sensor.path, f"{rate:.1f} Hz" if rate > 0 else "-", state]
+        changed = values != self.values
+        self.values = values
+        return changed
+
+
+class SensorListModel(ui.AbstractItemModel):
+    """Sensors of one type, sorted by path and filtered by a search string"""
+
+    def __init__(self):
+        super().__init__()
+        self._items = dict() # Maps sensor paths to SensorItems
+        self._paths = [] # Sorted paths of the rows matching the filter
+        self._rows = [] # SensorItems of self._paths, in the same order
+        self._filter = ""
+
+    def sync(self, sensors : dict, paths : set):
+        """Adds and removes the rows that differ from paths, returns whether the list changed"""
+        added = paths - self._items.keys()
+        removed = self._items.keys() - paths
+        if not added and not removed:
+            return False
+
+        for path in removed:
+            self._items.pop(path)
+            self._remove_row(path)
+
+        for path in added:
+            self._items[path] = SensorItem(sensors[path])
+            self._insert_row(path)
+
+        self._item_changed(None)
+        return True
+
+    def set_filter(self, text : str):
+        self._filter = text.strip().lower()
+        self._paths = sorted(path for path in self._items if self._matches(path))
+        self._rows = [self._items[path] for path in self._paths]
+        self._item_changed(None)
+
+    def update_stats(self, elapsed : float):
+        """Refreshes the rate and state of every row, only the changed ones are rebuilt"""
+        for item in self._items.values():
+            if item.update(elapsed) and self._matches(item.sensor.path):
+                self._item_changed(item)
+
+    def get_counts(self):
+        """Number of sensors, of subscribed sensors and of rows matching the filter"""
+        subscribed = sum(1 for item in self._items.values() if item.sensor.enabled)
+        return len(self._items), subscribed, len(self._rows)
+
+
+    def _matches(self, path : str):
+        return not self._filter or self._filter in path.lower()
+
+    def _insert_row(self, path : str):
+        if self._matches(path):
+            index = bisect_left(self._paths, path)
+            self._paths.insert(index, path)
+            self._rows.insert(index, self._items[path])
+
+    def _remove_row(self, path : str):
+        index = bisect_left(self._paths, path)
+        if index < len(self._paths) and self._paths[index] == path:
+            del self._paths[index]
+            del self._rows[index]
+
+
+    def get_item_children(self, item):
+        # Flat list: only the root has children
+        return [] if item is not None else self._rows
+
+    def get_item_value_model_count(self, item):
+        return len(COLUMN_WIDTHS)
+
+
+class SensorListDelegate(ui.AbstractItemDelegate):
+
+    def build_branch(self, model, item, column_id, level, expanded):
+        pass
+
+    def build_header(self, column_id):
+        ui.Label(["Path", "Rate", "State"][column_id], height=20)
+
+    def build_widget(self, model, item, column_id, level, expanded):
+        ui.Label(item.values[column_id], height=20, tooltip=item.values[column_id] if column_id == 0 else "")
+
+
+class SensorList():
+    """Collapsable frame with the search field, the counts and the list of the sensors of one type"""
+
+    def __init__(self, title : str):
+        self.title = title
+        self.model = SensorListModel()
+        self._delegate = SensorListDelegate()
+
+        self.frame = CollapsableFrame(title, collapsed=False)
+        with self.frame:
+            with ui.VStack(style=get_style(), spacing=5, height=0):
+                with ui.HStack(height=0, spacing=5):
+                    ui.Label("Search", width=60)
+                    self._search_field = ui.StringField(height=0)
+                    self._search_field.model.add_value_changed_fn(self._on_search_changed)
+
+                self._counts_label = ui.Label("")
+
+                with ui.ScrollingFrame(height=LIST_HEIGHT,
+                                       horizontal_scrollbar_policy=ui.ScrollBarPolicy.SCROLLBAR_AS_NEEDED,
+                                       vertical_scrollbar_policy=ui.ScrollBarPolicy.SCROLLBAR_AS_NEEDED):
+                    self._tree_view = ui.TreeView(self.model,
+                                                  delegate=self._delegate,
+                                                  root_visible=False,
+                                                  header_visible=True,
+                                                  columns_resizable=True,
+                                                  column_widths=COLUMN_WIDTHS)
+
+        self._update_counts()
+
+    def sync(self, sensors : dict, paths : set):
+        if self.model.sync(sensors, paths):
+            self._update_counts()
+
+    def update_stats(self, elapsed : float):
+        self.model.update_stats(elapsed)
+        self._update_counts()
+
+
+    def _on_search_changed(self, model):
+        self.model.set_filter(model.as_string)
+        self._update_counts()
+
+    def _update_counts(self):
+        total, subscribed, shown = self.model.get_counts()
+        text = f"{total} total, {subscribed} subscribed"
+        if shown != total:
+            text += f", {shown} shown"
+        self._counts_label.text = text
@@ -0,0 +1,198 @@
+import asyncio
+import inspect
+import json
+from contextvars import ContextVar
+from fnmatch import fnmatchcase
+
+from foxglove_websocket.server import FoxgloveServer
+from foxglove_websocket.types import Channel, ChannelId
+from websockets.exceptions import ConnectionClosed
+from websockets.frames import Opcode
+
+
+# Whether the message currently being sent should be compressed (None = default, compressed).
+# Set by the sender right before FoxgloveServer.send_message(), read when the websocket frames are encoded.
+compress_message = ContextVar("compress_message", default=None)
+
+# Default policy per sensor type: JPEG frames are already compressed, text-heavy channels shrink 5-10x
+DEFAULT_POLICIES = {"camera" : "never",
+                    "imu" : "auto",
+                    "articulation" : "auto",
+                    "tf_tree" : "auto",
+                    "segmentation" : "never",
+                    "segmentation_labels" : "auto",
+                    "scene" : "always",
+                    "camera_rendition" : "never"}
+
+COMPRESSION_POLICIES = ["always", "never", "auto"]
+
+
+class CompressionPolicy():
+    """Decides which messages are compressed with permessage-deflate"""
+
+    def __init__(self, enabled : bool = True, policies : dict = None, threshold : int = 1024, paths : dict = None):
+        self.enabled = enabled
+        self.policies = dict(DEFAULT_POLICIES, **(policies or {}))
+        self.threshold = threshold # Minimum payload size (bytes) compressed by the "auto" policy
+        self.paths = dict(paths or {}) # Glob pattern of the channel paths -> policy, overriding the sensor type
+        self._path_policies = dict() # Maps channel paths to their policy, resolved with their first message
+
+        for settings in (self.policies, self.paths):
+            for key, policy in settings.items():
+                if policy not in COMPRESSION_POLICIES:
+                    print(f"[Warning] Unknown compression policy \"{policy}\" for \"{key}\" (expected one of "
+                          f"{', '.join(COMPRESSION_POLICIES)}), using \"auto\"")
+                    settings[key] = "auto"
+
+    def for_type(self, sensor_type : str):
+        return self.policies.get(sensor_type, "auto")
+
+    def for_channel(self, path : str, sensor_type : str):
+        """Policy of a channel: the first path pattern matching it, the policy of its sensor type otherwise"""
+        policy = self._path_policies.get(path)
+        if policy is None:
+            policy = next((policy for pattern, policy in self.paths.items() if fnmatchcase(path, pattern)),
+                          self.for_type(sensor_type))
+            self._path_policies[path] = policy
+        return policy
+
+    def should_compress(self, policy : str, size : int):
+        if not self.enabled or policy == "never":
+            return False
+        if policy == "auto":
+            return size >= self.threshold
+        return True # "always", and protocol messages sent without a policy
+
+
+# Priority class per sensor type: small latency-critical messages are sent first, large ones within a byte budget
+DEFAULT_PRIORITIES = {"camera" : "low",
+                      "imu" : "high",
+                      "articulation" : "high",
+                      "tf_tree" : "high",
+                      "segmentation" : "low",
+                      "segmentation_labels" : "normal",
+                      "scene" : "normal",
+                      "camera_rendition" : "low",
+                      "contact" : "high",
+                      "rigid_body" : "high"}
+
+PRIORITY_CLASSES = ["high", "normal", "low"]
+PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW = range(len(PRIORITY_CLASSES))
+
+
+class SendPriorities():
+    """Decides the order in which the messages collected during a step are sent"""
+
+    def __init__(self, priorities : dict = None, budget : int = 262144, latest_only : list = None):
+        self.priorities = dict(DEFAULT_PRIORITIES, **(priorities or {}))
+        for sensor_type, priority in self.priorities.items():
+            if priority not in PRIORITY_CLASSES:
+                print(f"[Warning] Unknown priority \"{priority}\" for \"{sensor_type}\" (expected one of "
+                      f"{', '.join(PRIORITY_CLASSES)}), using \"normal\"")
+                self.priorities[sensor_type] = "normal"
+
+        self.budget = budget # Bytes of "low" messages sent per tick, before sending higher priorities again (0 = unlimited)
+        self.latest_only = set(latest_only or ()) # Sensor types whose waiting "low" message is replaced by a newer one
+
+    def for_type(self, sensor_type : str):
+        """Priority class of a sensor type, as an index of PRIORITY_CLASSES (0 = highest)"""
+        return PRIORITY_CLASSES.index(self.priorities.get(sensor_type, "normal"))
+
+    def keeps_latest_only(self, sensor_type : str):
+        """Whether a "low" message of the type still waiting is dropped when a newer one is collected"""
+        return sensor_type in self.latest_only
+
+
+class PolicyDeflate():
+    """Wraps a negotiated permessage-deflate extension to only compress the messages allowed by the policy"""
+
+    def __init__(self, extension):
+        self._extension = extension
+        self._compressing = True # Decision for the message being sent, kept for its continuation frames
+
+    def __getattr__(self, name):
+        return getattr(self._extension, name)
+
+    def decode(self, frame, **kwargs):
+        return self._extension.decode(frame, **kwargs)
+
+    def encode(self, frame):
+        # Messages are sent as a header frame followed by a payload frame, so the decision is made once per message
+        if frame.opcode in (Opcode.TEXT, Opcode.BINARY):
+            self._compressing = compress_message.get() is not False
+
+        # Uncompressed messages are allowed by RFC 7692: the RSV1 bit simply stays unset
+        if self._compressing:
+            return self._extension.encode(frame)
+        return frame
+
+
+class BridgeServer(FoxgloveServer):
+    """FoxgloveServer with control over the websocket compression of each channel"""
+
+    def __init__(self, *args, compression : CompressionPolicy = None, **kwargs):
+        self.compression = compression or CompressionPolicy()
+
+        # FoxgloveServer disables compression by default: let clients negotiate permessage-deflate
+        kwargs.setdefault("server_kwargs", {"compression": "deflate" if self.compression.enabled else None})
+        super().__init__(*args, **kwargs)
+
+    async def _handle_connection(self, connection, path):
+        # permessage-deflate is negotiated during the handshake, which is over at this point
+        connection.extensions = [PolicyDeflate(extension) if extension.name == "permessage-deflate" else extension
+                                 for extension in connection.extensions]
+
+        return await super()._handle_connection(connection, path)
+
+    async def add_channels(self, channels : list):
+        """Advertises several channels with a single message per client, returns their IDs"""
+        new_channels = []
+        for channel in channels:
+            new_id = self._next_channel_id
+            self._next_channel_id = ChannelId(new_id + 1)
+            self._channels[new_id] = Channel(id=new_id, **channel)
+            new_channels.append(self._channels[new_id])
+
+        if new_channels:
+            await self._broadcast_json({"op": "advertise", "channels": new_channels})
+        return [channel["id"] for channel in new_channels]
+
+    async def remove_channels(self, chan_ids : list):
+        """Unadvertises several channels with a single message per client"""
+        for chan_id in chan_ids:
+            del self._channels[chan_id]
+            for client in self._clients:
+                client.remove_channel(chan_id)
+
+        if chan_ids:
+            await self._broadcast_json({"op": "unadvertise", "channelIds": list(chan_ids)})
+
+    async def _broadcast_json(self, message : dict):
+        # Serialized once, and sent to all the clients concurrently
+        message = json.dumps(message, separators=(",", ":"))
+        await asyncio.gather(*[self._send_text(client.connection, message) for client in self._clients])
+
+    async def _send_text(self, connection, message : str):
+        try:
+            await connection.send(message)
+        except ConnectionClosed:
+            pass
+
+    async def send_to_client(self, client, sub_id, timestamp : int, payload : bytes):
+        """Sends a message to a single subscription of a client"""
+        await self._send_message_data(client.connection, subscription=sub_id, timestamp=timestamp, payload=payload)
+
+    async def _handle_client_text_message(self, client, message):
+        previous_subscriptions = client.subscriptions
+        await super()._handle_client_text_message(client, message)
+
+        # FoxgloveServer only notifies the first subscriber of a channel, the listener may also want every new one
+        on_client_subscribe = getattr(self._listener, "on_client_subscribe", None)
+        if message["op"] != "subscribe" or on_client_subscribe is None:
+            return
+
+        for sub_id, chan_id in client.subscriptions.items():
+            if sub_id not in previous_subscriptions:
+                result = on_client_subscribe(self, client, sub_id, chan_id)
+                if inspect.isawaitable(result):
+                    await result
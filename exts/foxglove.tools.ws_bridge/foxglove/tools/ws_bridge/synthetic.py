@@ -0,0 +1,247 @@
+# Stand-ins for the Isaac Sim and USD modules read by the bridge, so that the regular DataCollector and IsaacSensor
+# run without Isaac Sim (load tests, allocation tests). install() registers them in sys.modules as omni and pxr:
+# a synthetic stage holds cameras, IMUs, articulations and a tree of frames, and the sensors created by IsaacSensor
+# produce readings of the same types and sizes as the Isaac ones.
+#
+# Only the calls made by data_collection.py for these sensor types are provided.
+
+import math
+import sys
+import time
+import types
+
+import numpy as np
+
+
+_stage = None # Stage returned by omni.usd.get_context().get_stage()
+
+
+class Path(str):
+    """Sdf.Path stand-in: the string of the path"""
+
+    @property
+    def name(self):
+        return self.rsplit("/", 1)[-1] or "/"
+
+
+class Prim():
+    """Usd.Prim stand-in"""
+
+    def __init__(self, stage, path : str, type_name : str = "Xform", schemas : list = None):
+        self._stage = stage
+        self._path = Path(path)
+        self._type_name = type_name
+        self._schemas = schemas or []
+        self._children = []
+        self.transform = Matrix4d((0.1, 0.0, 0.0), (0.0, 0.0, 0.0, 1.0)) # Local transform
+
+    def GetPath(self):
+        return self._path
+
+    def GetName(self):
+        return self._path.name
+
+    def GetTypeName(self):
+        return self._type_name
+
+    def GetAppliedSchemas(self):
+        return self._schemas
+
+    def GetChildren(self):
+        return self._children
+
+    def GetStage(self):
+        return self._stage
+
+    def IsValid(self):
+        return True
+
+    def IsPseudoRoot(self):
+        return self._path == "/"
+
+    def IsA(self, schema):
+        return getattr(schema, "type_name", None) in (None, self._type_name)
+
+
+class Stage():
+    """Usd.Stage stand-in: cameras, IMUs and articulations under /World, and a binary tree of frames under
+    /World/Frames, all of them in the transform tree"""
+
+    def __init__(self, cameras : int = 1, imus : int = 1, articulations : int = 1, joints : int = 12,
+                 tf_frames : int = 50):
+        self.joints = joints # Joints of each articulation
+        self._prims = dict()
+
+        self._add("/", "")
+        self._add("/World")
+        for i in range(cameras):
+            self._add(f"/World/Camera_{i}", "Camera")
+        for i in range(imus):
+            self._add(f"/World/Imu_{i}", "IsaacImuSensor")
+        for i in range(articulations):
+            self._add(f"/World/Robot_{i}", schemas=["PhysicsArticulationRootAPI"])
+
+        frames = [self._add("/World/Frames")] if tf_frames else []
+        for i in range(1, tf_frames):
+            frames.append(self._add(f"{frames[(i - 1) // 2].GetPath()}/frame_{i}"))
+
+    def _add(self, path : str, type_name : str = "Xform", schemas : list = None):
+        prim = Prim(self, path, type_name, schemas)
+        self._prims[path] = prim
+        if path != "/":
+            self._prims[path.rsplit("/", 1)[0] or "/"]._children.append(prim)
+        return prim
+
+    def GetPrimAtPath(self, path : str):
+        return self._prims.get(str(path))
+
+    def GetPseudoRoot(self):
+        return self._prims["/"]
+
+    def Traverse(self):
+        return (prim for path, prim in self._prims.items() if path != "/")
+
+
+class Quat():
+    """Gf.Quatd / Gf.Quatf stand-in"""
+
+    def __init__(self, real = 1.0, imaginary : tuple = (0.0, 0.0, 0.0)):
+        if isinstance(real, Quat): # Conversion, e.g. Gf.Quatf(quatd)
+            real, imaginary = real.GetReal(), real.GetImaginary()
+        self._real = real
+        self._imaginary = tuple(imaginary)
+
+    def GetImaginary(self):
+        return self._imaginary
+
+    def GetReal(self):
+        return self._real
+
+
+class Matrix4d():
+    """Gf.Matrix4d stand-in, as returned by GetLocalTransformation(): a translation and a rotation"""
+
+    def __init__(self, translation : tuple, rotation : tuple):
+        self._translation = translation
+        self._rotation = Quat(rotation[3], rotation[:3]) # xyzw
+
+    def ExtractTranslation(self):
+        return self._translation
+
+    def ExtractRotationQuat(self):
+        return self._rotation
+
+    def RemoveScaleShear(self):
+        return self
+
+
+class Xformable():
+    """UsdGeom.Xformable stand-in"""
+
+    def __init__(self, prim : Prim):
+        self._prim = prim
+
+    def GetLocalTransformation(self):
+        return self._prim.transform
+
+
+class Camera():
+    """omni.isaac.sensor.Camera stand-in, returning a few noisy RGBA gradients costing about as much to encode as
+    rendered frames"""
+
+    def __init__(self, prim_path : str, resolution : tuple = (128, 128)):
+        self.prim_path = prim_path
+        self.resolution = resolution
+        self._frames = []
+        self._tick = 0
+
+    def initialize(self):
+        width, height = self.resolution
+        rng = np.random.default_rng(0)
+        gradient = np.linspace(0, 255, width, dtype=np.float32)[np.newaxis, :, np.newaxis]
+        for i in range(8):
+            noise = rng.normal(0, 16, (height, width, 3))
+            frame = np.full((height, width, 4), 255, dtype=np.uint8)
+            frame[..., :3] = np.clip(np.roll(gradient, i * 8, axis=1) + noise, 0, 255)
+            self._frames.append(frame)
+
+    def get_rgba(self):
+        self._tick += 1
+        return self._frames[self._tick % len(self._frames)]
+
+    def get_current_frame(self):
+        return dict()
+
+    def destroy(self):
+        self._frames = []
+
+
+class ImuSensorInterface():
+    """IMU sensor interface stand-in, whose readings change with the wall time"""
+
+    def get_sensor_reading(self, path : str):
+        t = time.monotonic()
+        orientation = types.SimpleNamespace(x=0.0, y=0.0, z=math.sin(t / 2), w=math.cos(t / 2))
+        return types.SimpleNamespace(is_valid=True, time=t, ang_vel_x=math.sin(t), ang_vel_y=math.cos(t),
+                                     ang_vel_z=0.0, lin_acc_x=0.0, lin_acc_y=0.0, lin_acc_z=9.81,
+                                     orientation=orientation)
+
+
+class Articulation():
+    """omni.isaac.core Articulation stand-in, with the number of joints of the synthetic stage"""
+
+    def __init__(self, prim_path : str):
+        self.prim_path = prim_path
+        self.dof_names = [f"joint_{i}" for i in range(_stage.joints if _stage else 12)]
+        self._offsets = np.arange(len(self.dof_names))
+
+    def initialize(self):
+        pass
+
+    def get_joint_positions(self):
+        return np.sin(time.monotonic() + self._offsets)
+
+    def get_joint_velocities(self):
+        return np.cos(time.monotonic() + self._offsets)
+
+    def get_measured_joint_efforts(self):
+        return np.sin(time.monotonic() + self._offsets) * 0.1
+
+
+def _module(name : str, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    module.__synthetic__ = True
+    return module
+
+
+def install(stage : Stage):
+    """Registers the stand-ins as the omni and pxr modules, reading from stage. Fails within Isaac Sim"""
+    global _stage
+
+    _stage = stage
+    if "omni" in sys.modules:
+        if not getattr(sys.modules["omni"], "__synthetic__", False):
+            raise RuntimeError("The Isaac Sim modules are loaded, the synthetic ones cannot replace them")
+        return # Already installed, the modules read the new stage
+
+    context = types.SimpleNamespace(get_stage=lambda: _stage)
+    modules = {"omni.usd" : _module("omni.usd", get_context=lambda: context),
+               "omni.isaac.sensor" : _module("omni.isaac.sensor", Camera=Camera,
+                                             _sensor=types.SimpleNamespace(
+                                                 acquire_imu_sensor_interface=ImuSensorInterface)),
+               "omni.isaac.core.articulations" : _module("omni.isaac.core.articulations", Articulation=Articulation),
+               "pxr.Gf" : _module("pxr.Gf", Quatd=Quat, Quatf=Quat),
+               "pxr.Usd" : _module("pxr.Usd", Prim=Prim, Stage=Stage),
+               "pxr.UsdGeom" : _module("pxr.UsdGeom", Xformable=Xformable,
+                                       Camera=types.SimpleNamespace(type_name="Camera"))}
+
+    # Parent packages, each holding its submodules as attributes like imported packages do
+    for name in list(modules):
+        while "." in name:
+            parent, child = name.rsplit(".", 1)
+            modules.setdefault(parent, _module(parent))
+            setattr(modules[parent], child, modules[name])
+            name = parent
+
+    sys.modules.update(modules)
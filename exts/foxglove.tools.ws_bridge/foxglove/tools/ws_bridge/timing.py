@@ -0,0 +1,30 @@
+import time
+from functools import wraps
+
+
+# Time budgets (ms) of the extension entry points, so that hot-reloading stays instant
+STARTUP_BUDGETS = {"on_startup" : 50,
+                   "build_ui" : 250}
+
+startup_times = dict() # Last measured duration (ms) of each entry point
+
+
+def startup_budget(name : str):
+    """Decorator measuring a function and warning when it exceeds its budget in STARTUP_BUDGETS"""
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = (time.perf_counter() - start) * 1000
+                startup_times[name] = elapsed
+
+                budget = STARTUP_BUDGETS.get(name)
+                if budget is not None and elapsed > budget:
+                    print(f"[Foxglove Warning] {name} took {elapsed:.1f} ms (budget: {budget} ms)")
+        return wrapper
+
+    return decorator
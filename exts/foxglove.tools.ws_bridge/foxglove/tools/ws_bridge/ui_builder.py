@@ -1,6 +1,8 @@
+import time
 import webbrowser
 
 import omni
+import omni.kit.app
 import omni.ui as ui
 from omni.isaac.ui.ui_utils import get_style
 from omni.isaac.ui.element_wrappers import (
@@ -13,7 +15,34 @@ from omni.isaac.ui.element_wrappers import (
     TextBlock,
 )
 
+from .config import BridgeConfig
 from .data_collection import DataCollector
+from .sensor_list import SensorList
+from .timing import startup_budget
+
+STATS_PERIOD = 1.0 # Seconds between two refreshes of the rates and states shown in the sensor lists
+
+# Carb setting holding the path of the JSON settings of the bridge, e.g. --/exts/foxglove.tools.ws_bridge/config_file=...
+CONFIG_FILE_SETTING = "/exts/foxglove.tools.ws_bridge/config_file"
+
+
+def load_config():
+    """Settings of the extension: the JSON file of the config_file setting, the default ones otherwise"""
+    import carb.settings
+
+    path = carb.settings.get_settings().get(CONFIG_FILE_SETTING)
+    if path:
+        try:
+            return BridgeConfig.from_file(path), path
+        except (OSError, ValueError, TypeError) as e:
+            print(f"[Error] Could not load the Foxglove settings from {path}: {e}")
+
+    return BridgeConfig(), None
+
+
+def describe_shard_rule(rule : dict):
+    """Channels published by a shard: its sensor types and path patterns, e.g. camera, camera_rendition; /World/Arm/*"""
+    return "; ".join(", ".join(rule[key]) for key in ("types", "paths") if rule.get(key))
 
 class UIBuilder:
     def __init__(self):
@@ -31,12 +60,19 @@ class UIBuilder:
                 )
 
         # Foxglove inits
-        self.data_collect = DataCollector()
+        self.config, self.config_file = load_config()
+        self.data_collect = DataCollector(self.config)
         self.publishing = False
-        self.last_saved_port = 8765
-        self.server_port = 8765
-        self.cam_width = 128
-        self.cam_height = 128
+        self.last_saved_port = self.config.port
+        self.server_port = self.config.port
+        self.cam_width = self.config.cam_width
+        self.cam_height = self.config.cam_height
+        self._servers_label = None
+
+        # Sensor lists, per sensor type, and the refresh of their stats
+        self.sensor_lists = dict()
+        self._update_sub = None
+        self._last_stats_update = time.monotonic()
 
 
     ###################################################################################
@@ -81,9 +117,7 @@ class UIBuilder:
                 self._status_report_field.set_text(status)
 
             # Update UI
-            self._update_camera_frame()
-            self._update_imu_frame()
-            self._update_articulation_frame()
+            self._update_sensor_lists()
             self.tf_root_dropdown.repopulate()
 
     def cleanup(self):
@@ -97,10 +131,13 @@ class UIBuilder:
         for ui_elem in self.wrapped_ui_elements:
             ui_elem.cleanup()
         
+        self._update_sub = None
+
         # Foxglove objects
         self.publishing = False
         self.data_collect.cleanup()
 
+    @startup_budget("build_ui")
     def build_ui(self):
         """
         Build a custom UI tool to run your extension.
@@ -121,14 +158,8 @@ class UIBuilder:
         self._create_description_frame_2()
         self._create_spacer(10)
 
-        # Create a UI frame for the list of Cameras
-        self._create_camera_frame()
-
-        # Create a UI frame for the list of IMUs
-        self._create_imu_frame()
-
-        # Create a UI frame for the list of Articulations
-        self._create_articulation_frame()
+        # Create the UI frames listing the Cameras, IMUs and Articulations
+        self._create_sensor_lists()
 
         # Create a UI frame for the settings frame
         self._create_settings_frame()
@@ -140,7 +171,8 @@ class UIBuilder:
         # Start server once everything is initialized
         self.data_collect.fox_wrap.start(self.server_port, self.data_collect.sensors)
         self.publishing = True
-        status = f"Server was started at\nws://0.0.0.0:{self.last_saved_port}"
+        self._update_servers_label()
+        status = "Server was started at\n" + ", ".join(f"ws://0.0.0.0:{port}" for port in self.data_collect.fox_wrap.get_ports())
         self._status_report_field.set_text(status)
 
 
@@ -197,37 +229,31 @@ class UIBuilder:
                 self.wrapped_ui_elements.append(publish_button)
 
 
-    def _create_camera_frame(self):
-        self._camera_frame = CollapsableFrame("Cameras", collapsed=False)
-        self._update_camera_frame()
-    
-    def _update_camera_frame(self):
-        with self._camera_frame:
-            with ui.VStack(style=get_style(), spacing=5, height=0):
-                for cam in self.data_collect.sensors_sorted["camera"]:
-                    ui.Label(cam)
-
+    def _create_sensor_lists(self):
+        self.sensor_lists = {"camera" : SensorList("Cameras"),
+                             "imu" : SensorList("IMUs"),
+                             "articulation" : SensorList("Articulations"),
+                             "contact" : SensorList("Contact Sensors"),
+                             "rigid_body" : SensorList("Rigid Bodies")}
+        self._update_sensor_lists()
 
-    def _create_imu_frame(self):
-        self._imu_frame = CollapsableFrame("IMUs", collapsed=False)
-        self._update_imu_frame()
-    
-    def _update_imu_frame(self):
-        with self._imu_frame:
-            with ui.VStack(style=get_style(), spacing=5, height=0):
-                for imu in self.data_collect.sensors_sorted["imu"]:
-                    ui.Label(imu)
+        # Rates and subscription states are refreshed on app updates, so they stay live while the timeline is paused
+        self._last_stats_update = time.monotonic()
+        self._update_sub = omni.kit.app.get_app().get_update_event_stream().create_subscription_to_pop(
+            self._on_app_update, name="Foxglove sensor list stats")
 
+    def _update_sensor_lists(self):
+        """Adds and removes the rows of the sensors added to or removed from the stage"""
+        for sensor_type, sensor_list in self.sensor_lists.items():
+            sensor_list.sync(self.data_collect.sensors, self.data_collect.sensors_sorted[sensor_type])
 
-    def _create_articulation_frame(self):
-        self._articulation_frame = CollapsableFrame("Articulations", collapsed=False)
-        self._update_articulation_frame()
-    
-    def _update_articulation_frame(self):
-        with self._articulation_frame:
-            with ui.VStack(style=get_style(), spacing=5, height=0):
-                for articulation in self.data_collect.sensors_sorted["articulation"]:
-                    ui.Label(articulation)
+    def _on_app_update(self, event):
+        now = time.monotonic()
+        elapsed = now - self._last_stats_update
+        if elapsed >= STATS_PERIOD:
+            self._last_stats_update = now
+            for sensor_list in self.sensor_lists.values():
+                sensor_list.update_stats(elapsed)
 
 
     def _create_settings_frame(self):
@@ -235,6 +261,7 @@ class UIBuilder:
         with self._settings_frame:
             with ui.VStack(style=get_style(), spacing=5, height=0):
                 self._create_server_port_frame()
+                self._create_servers_frame()
                 self._create_camera_resolution_frame()
                 self._create_tf_root_frame()
 
@@ -258,6 +285,31 @@ class UIBuilder:
                 self.wrapped_ui_elements.append(apply_button)
 
 
+    def _create_servers_frame(self):
+        self._servers_frame = CollapsableFrame("Servers", collapsed=False)
+        with self._servers_frame:
+            with ui.VStack(style=get_style(), spacing=5, height=0):
+                ui.Label(f"   Settings file: {self.config_file or f'none (set {CONFIG_FILE_SETTING})'}",
+                         word_wrap=True)
+                self._servers_label = ui.Label("", word_wrap=True)
+        self._update_servers_label()
+
+    def _update_servers_label(self):
+        """Lists the port of each server, and the channels of the shards (see BridgeConfig.shards)"""
+        if self._servers_label is None:
+            return
+
+        ports = self.data_collect.fox_wrap.get_ports()
+        if not ports:
+            self._servers_label.text = "   Not running"
+            return
+
+        lines = [f"   ws://0.0.0.0:{ports[0]}: all other channels"]
+        for port, rule in zip(ports[1:], self.config.shards):
+            lines.append(f"   ws://0.0.0.0:{port}: {describe_shard_rule(rule)}")
+        self._servers_label.text = "\n".join(lines)
+
+
     def _create_camera_resolution_frame(self):
         self._camera_resolution_frame = CollapsableFrame("Camera Resolution", collapsed=False)
         with self._camera_resolution_frame:
@@ -359,8 +411,10 @@ class UIBuilder:
 
     def _on_port_applied(self):
         self.last_saved_port = self.server_port
+        self.config.port = self.server_port
         self.data_collect.fox_wrap.close()
         self.data_collect.fox_wrap.start(self.server_port, self.data_collect.sensors)
+        self._update_servers_label()
         status = f"Server port was set to {self.server_port}"
         self._status_report_field.set_text(status)
 
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The tests import the extension's package from its folder, like the load test and replay entry points
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
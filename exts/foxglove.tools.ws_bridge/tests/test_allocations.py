@@ -0,0 +1,93 @@
+# Allocations of a physics step (collect_data() and the hand-over to the server threads), counted with tracemalloc by
+# the load test harness: the regular DataCollector and IsaacSensor read a synthetic stage (see synthetic.py), and
+# besides its payloads a step allocates little more than its encoding buffers, its messages being reused.
+
+import asyncio
+import logging
+import socket
+
+from foxglove.tools.ws_bridge.config import BridgeConfig
+from foxglove.tools.ws_bridge.loadtest import ALLOCATION_BUDGET, create_collector, measure_allocations, percentile
+
+WARMUP_STEPS = 30 # Lets the reused messages and buffers reach their steady state size
+MEASURED_STEPS = 120
+PHYSICS_RATE = 120.0
+
+# Bytes allocated at the peak of a step besides its payloads, with the stage of create_test_collector(): mostly the
+# buffers of the JSON encoder, a step rebuilding its messages instead of reusing them allocates about 2 kB more
+PEAK_BUDGET = 6144
+
+# Messages and dicts kept by IsaacSensor between steps
+REUSED_ATTRIBUTES = ["_image_message", "_jpeg_encoder", "_tf_message", "_imu_reading", "_joint_states"]
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def create_test_collector():
+    config = BridgeConfig(port=get_free_port(), rates={"camera": 0, "tf_tree": 0})
+    return create_collector(config, cameras=1, imus=4, articulations=2, tf_frames=50)
+
+
+async def run_steps(collector, steps : int):
+    for _ in range(steps):
+        collector.collect_data()
+        await asyncio.sleep(1.0 / PHYSICS_RATE)
+
+
+async def measure_step_allocations(collector):
+    """Blocks kept per step besides the payloads, and median bytes allocated per step at the peak besides them, once
+    the sensors are enabled and in a steady state"""
+    logging.getLogger("FoxgloveServer").setLevel(logging.WARNING)
+    collector.fox_wrap.start(collector.config.port, collector.sensors)
+    try:
+        for sensor in collector.sensors.values():
+            sensor.enable()
+        await run_steps(collector, WARMUP_STEPS)
+
+        blocks, _, payloads, sites, peaks = await measure_allocations(collector, PHYSICS_RATE, MEASURED_STEPS)
+    finally:
+        collector.cleanup()
+
+    assert payloads == 8 * MEASURED_STEPS # Every sensor publishes on every step
+    return max(blocks - payloads, 0) / MEASURED_STEPS, percentile(peaks, 0.5), sites
+
+
+def test_step_allocations():
+    collector = create_test_collector()
+
+    extra, peak, sites = asyncio.run(measure_step_allocations(collector))
+    assert extra <= ALLOCATION_BUDGET, sites
+    assert peak <= PEAK_BUDGET
+
+
+def test_rebuilt_messages_exceed_budget():
+    # The budgets catch the messages being created again on each step...
+    collector = create_test_collector()
+    collect_data = collector.collect_data
+
+    def collect_data_without_reuse():
+        for sensor in collector.sensors.values():
+            for attribute in REUSED_ATTRIBUTES:
+                setattr(sensor, attribute, None)
+        collect_data()
+
+    collector.collect_data = collect_data_without_reuse
+
+    extra, _, _ = asyncio.run(measure_step_allocations(collector))
+    assert extra > ALLOCATION_BUDGET
+
+
+def test_copied_frames_exceed_budget():
+    # ... and the buffers allocated and freed during a step, like a copy of the camera frames
+    collector = create_test_collector()
+    for sensor in collector.sensors.values():
+        if sensor.type == "camera":
+            sensor.read_rgba = lambda now = None, read_rgba = sensor.read_rgba: read_rgba(now).copy()
+
+    extra, peak, sites = asyncio.run(measure_step_allocations(collector))
+    assert extra <= ALLOCATION_BUDGET, sites
+    assert peak > PEAK_BUDGET